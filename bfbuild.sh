@@ -2,6 +2,32 @@
 
 # Build BitFunnel
 # CMAKE_EXPORT_COMPILE_COMMANDS generates a compile_commands.json file containing the exact compiler calls
+#
+# ./bfbuild.sh              Pull the latest revision, build it in cmake/BitFunnel & link /usr/bin/bitfunnel
+# ./bfbuild.sh <revision>   Build a commit, tag or branch in cmake/BitFunnel-<commit>, from its own
+#                           worktree (git/BitFunnel-<commit>), leaving every other build alone.
+#                           The program's path is printed last; an existing build is reused.
+# Each build folder's REVISION file names the commit it was built from (see testkit/history.py)
+
+if [ -n "$1" ]; then
+    cd git/BitFunnel
+    git fetch
+    commit=$(git rev-parse --verify "$1^{commit}") || exit 1
+    commit=${commit:0:12}
+    [ -d ../BitFunnel-$commit ] || git worktree add --detach ../BitFunnel-$commit $commit || exit 1
+    cd ../../cmake
+    if [ ! -f BitFunnel-$commit/REVISION ]; then
+        rm -rf BitFunnel-$commit
+        mkdir BitFunnel-$commit
+        cd BitFunnel-$commit
+        cmake -DCMAKE_BUILD_TYPE=Release -DCMAKE_EXPORT_COMPILE_COMMANDS=1 -G "Unix Makefiles" ../../git/BitFunnel-$commit
+        make || exit 1
+        git -C ../../git/BitFunnel-$commit rev-parse HEAD > REVISION
+        cd ..
+    fi
+    echo $PWD/BitFunnel-$commit/tools/BitFunnel/src/BitFunnel
+    exit 0
+fi
 
 cd git/BitFunnel
 git pull
@@ -11,5 +37,6 @@ mkdir BitFunnel
 cd BitFunnel
 cmake -DCMAKE_BUILD_TYPE=Release -DCMAKE_EXPORT_COMPILE_COMMANDS=1 -G "Unix Makefiles" ../../git/BitFunnel
 make
+git -C ../../git/BitFunnel rev-parse HEAD > REVISION
 sudo ln -fs /bf/cmake/BitFunnel/tools/BitFunnel/src/BitFunnel /usr/bin/bitfunnel
 cd ../..
\ No newline at end of file
@@ -1,6 +1,24 @@
 #!/bin/bash
 
 # Build MG4J
+#
+# ./mg4jbuild.sh             Pull the latest revision & build it in git/mg4j-workbench
+# ./mg4jbuild.sh <revision>  Build a commit, tag or branch in its own worktree,
+#                            git/mg4j-workbench-<commit>, leaving every other build alone.
+#                            That folder is printed last (give it to Corpus as mg4j_workbench);
+#                            an existing build is reused.
+
+if [ -n "$1" ]; then
+    cd git/mg4j-workbench
+    git fetch
+    commit=$(git rev-parse --verify "$1^{commit}") || exit 1
+    commit=${commit:0:12}
+    [ -d ../mg4j-workbench-$commit ] || git worktree add --detach ../mg4j-workbench-$commit $commit || exit 1
+    cd ../mg4j-workbench-$commit
+    ls target/*.jar > /dev/null 2>&1 || mvn package || exit 1
+    echo $PWD
+    exit 0
+fi
 
 cd git/mg4j-workbench
 git pull
@@ -0,0 +1,133 @@
+# ArtifactCache keeps built artifacts (chunk copies, BitFunnel statistics and
+# termtables, MG4J and PEF indexes) in folders named by a fingerprint of
+# everything they were built from: manifest contents, chunk sizes & mtimes,
+# engine binaries and build parameters.
+#
+# The folder an engine expects (e.g., docs/mg4jindex) is a symlink to the
+# cached folder for its current inputs. An artifact is only complete once its
+# commit marker has been written (atomically) after a successful build, so a
+# build interrupted by a crash is discarded and redone, never reused. Changed
+# inputs select a different folder, so a stale artifact is never used either,
+# while one matching earlier inputs is simply linked again.
+#
+# Things you can do with the cache (each Corpus has one, as corpus.artifacts):
+# .build(link, kind, fingerprint, action)   # link to a complete artifact, building it if needed
+# .fingerprint(**inputs)                    # fingerprint of a build's inputs
+# .file_hash(path)                          # content hash of a file (e.g., an engine binary)
+# .manifest_hash(manifest)                  # hash of a manifest and the chunks it lists
+# .files_hash(files)                        # hash of file names, sizes & mtimes
+
+import concurrent.futures
+import hashlib
+import json
+import os
+import shutil
+import time
+
+MARKER = ".complete"
+STAT_THREADS = 32
+
+class ArtifactCache:
+    def __init__(self, root):
+        self.root = root
+        self.hashes = {}            # (path, size, mtime) -> content or manifest hash
+
+    # Make link point to the complete artifact of this kind & fingerprint,
+    # first building it by calling action(folder) if no complete one exists.
+    # action must raise an exception if the build fails.
+    def build(self, link, kind, fingerprint, action, inputs=None):
+        folder = os.path.join(self.root, "{0}-{1}".format(kind, fingerprint[:16]))
+        if self.is_complete(folder, fingerprint):
+            print("Using cached {0} for {1}".format(folder, link))
+            self.link(link, folder)
+            return folder
+
+        if os.path.exists(folder):
+            print("Discarding incomplete {0}".format(folder))
+            shutil.rmtree(folder)
+        os.makedirs(folder)
+        self.link(link, folder)
+        action(folder)
+        self.commit(folder, fingerprint, inputs)
+        return folder
+
+    # Is there a complete artifact with this fingerprint in folder?
+    def is_complete(self, folder, fingerprint=None):
+        marker = read_marker(folder)
+        return marker is not None and (fingerprint is None or marker["fingerprint"] == fingerprint)
+
+    # Fingerprint of the complete artifact a link points to (None if incomplete)
+    def fingerprint_of(self, link):
+        marker = read_marker(os.path.realpath(link))
+        return marker["fingerprint"] if marker is not None else None
+
+    # Atomically mark folder as a complete artifact
+    def commit(self, folder, fingerprint, inputs=None):
+        marker = os.path.join(folder, MARKER)
+        with open(marker + ".tmp", 'w') as file:
+            json.dump({"fingerprint": fingerprint, "inputs": inputs, "time": time.time()}, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(marker + ".tmp", marker)
+
+    # Atomically (re)point link at folder. A real folder found at link predates
+    # the cache and can't be trusted, so it is moved aside (not deleted).
+    def link(self, link, folder):
+        if os.path.isdir(link) and not os.path.islink(link):
+            stale = "{0}.stale-{1}".format(link, int(time.time()))
+            print("Moving unverified {0} to {1}".format(link, stale))
+            os.rename(link, stale)
+        parent = os.path.dirname(link)
+        if parent and not os.path.exists(parent):
+            os.makedirs(parent)
+        temp = "{0}.link-{1}".format(link, os.getpid())
+        if os.path.lexists(temp):
+            os.remove(temp)
+        os.symlink(folder, temp)
+        os.replace(temp, link)
+
+    # Fingerprint of named inputs (strings, numbers and other fingerprints)
+    def fingerprint(self, **inputs):
+        return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+    # Content hash of a file, remembered while its size and mtime are unchanged
+    # A program name is looked up on the PATH
+    def file_hash(self, path):
+        if not os.path.exists(path) and shutil.which(path):
+            path = shutil.which(path)
+        stat = os.stat(path)
+        key = (path, stat.st_size, stat.st_mtime_ns)
+        if key not in self.hashes:
+            digest = hashlib.sha256()
+            with open(path, 'rb') as file:
+                for block in iter(lambda: file.read(1 << 20), b""):
+                    digest.update(block)
+            self.hashes[key] = digest.hexdigest()
+        return self.hashes[key]
+
+    # Hash of a manifest's contents plus the size & mtime of every chunk it lists
+    def manifest_hash(self, manifest):
+        stat = os.stat(manifest)
+        key = (manifest, stat.st_size, stat.st_mtime_ns)
+        if key not in self.hashes:
+            with open(manifest) as file:
+                self.hashes[key] = self.files_hash([line.strip() for line in file if line.strip()])
+        return self.hashes[key]
+
+    # Hash of the names, sizes & mtimes of files
+    # (they are stat'ed in parallel: there are thousands of chunks for GOV2)
+    def files_hash(self, files):
+        with concurrent.futures.ThreadPoolExecutor(STAT_THREADS) as pool:
+            stats = list(pool.map(chunk_stat, files))
+        return self.fingerprint(files=files, stats=stats)
+
+def chunk_stat(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+def read_marker(folder):
+    try:
+        with open(os.path.join(folder, MARKER)) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
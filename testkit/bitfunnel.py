@@ -1,24 +1,58 @@
 # Things you can do with BitFunnel after establishing it
 # .copy_chunks(newfolder, filter, annotate)  # create an altered copy of current chunks
-# .build_index(density, treatment)           # Run statistics and termtable, if not existing
-# .run_queries(querylog, threads)            # Run queries and store results
+# .build_index(density, treatment)           # Run statistics and termtable, if not already built
+# .build_variant(density, treatment)         # Build a termtable variant in its own config folder
+# .use_variant(density, treatment)           # Run queries with a variant (None: default config)
+# .run_queries(querylog, threads, warmup)    # Run queries (after warmup runs of the log) and store results
+#                                            # (and their matches, QueryMatches.csv, if matches is set)
+# .index_paths()                             # Files read by run_queries
+# .memory_estimate()                         # Slice buffer memory given to the repl
+# .start_session(threads, query_threads)     # Keep repl running with the index loaded
+# .stop_session()                            # Quit the running repl
+# .for_corpus(corpus)                        # Same settings for another corpus (e.g., a shard)
 
 import os
+import shutil
+
+import sizing
+from artifacts import MARKER, read_marker
+from repl import ReplSession, remove_warmup, warmup_commands
+from verify import MATCH_FILES
+
+DEFAULT_DENSITY = 0.15
+DEFAULT_TREATMENT = "Optimal"
 
 class BitFunnel:
     def __init__(self,
                  corpus,                          # Corpus object handling docs & queries
                  bf_executable,                   # Full path to BitFunnel program
-                 memory = None):                  # How much memory to use when running BitFunnel
+                 memory = None,                   # How much memory to use when running BitFunnel
+                                                  # (None: predicted from statistics, see sizing.py)
+                 matches = False):                # Also write each query's matches, for verify.py
 
         self.corpus = corpus
         corpus.add_engine('bf', self)
 
         self.bf_executable = bf_executable
-        if memory == None:
-            self.memory = ""
-        else:
-            self.memory = "-memory {0}".format(memory)
+        self.memory = memory
+        self.matches = matches
+
+        self.session = None
+        self.config_name = "config"         # Folder (in docs) holding the termtable to query
+
+        # Resources needed by build_index, for Corpus.build_indexes
+        self.build_requires = []
+        self.build_cores = 1
+        self.build_memory = 4
+
+        # Queries are given as terms (see querylogs.py, Corpus.prepare_queries)
+        self.query_format = "text"
+
+    # A BitFunnel with the same settings, for another corpus (e.g., a shard)
+    def for_corpus(self, corpus):
+        engine = BitFunnel(corpus, self.bf_executable, self.memory, self.matches)
+        engine.config_name = self.config_name
+        return engine
 
     # Create a copy of the corpus chunks using BitFunnel filter
     # Filter examples:
@@ -26,43 +60,105 @@ class BitFunnel:
     #    -count 1000        (# of documents to copy)
     #    -random 4301 0.25  (copy a random quarter of the docs)
     # Specify 'annotate' for annotate to inject shard terms into corpus
+    # This only performs work if no copy was made from the same chunks & filter
     def copy_chunks(self, newfolder, filter=None, annotate=None):
 
-        self.corpus.docs_folder = os.path.join(self.corpus.data_folder, newfolder)
-        if not os.path.exists(self.corpus.docs_folder):
-            os.makedirs(self.corpus.docs_folder)
-            new_chunks_folder = os.path.join(self.corpus.docs_folder, "chunks")
-            os.makedirs(new_chunks_folder)
-        
-            if annotate is None:
-                annotate = ""
-            else:
-                annotate = "-writer " + annotate
+        if annotate is None:
+            annotate = ""
+        else:
+            annotate = "-writer " + annotate
+
+        artifacts = self.corpus.artifacts
+        fingerprint = artifacts.fingerprint(manifest=artifacts.manifest_hash(self.corpus.manifest),
+                                            bitfunnel=artifacts.file_hash(self.bf_executable),
+                                            filter=filter,
+                                            annotate=annotate)
 
+        def filter_chunks(new_chunks_folder):
             args = ("{0} filter {1} {2} {3} {4}".format(self.bf_executable,
                                                         self.corpus.manifest,
                                                         new_chunks_folder,
                                                         filter,
                                                         annotate))
             self.corpus.execute(args, "bf_copy_chunks.log")
+            self.corpus.check_last_run()
+
+        self.corpus.docs_folder = os.path.join(self.corpus.data_folder, newfolder)
+        artifacts.build(os.path.join(self.corpus.docs_folder, "chunks"), "chunks", fingerprint, filter_chunks,
+                        {"manifest": self.corpus.manifest, "filter": filter, "annotate": annotate})
 
         self.corpus.set_chunks_folder("chunks", "chunks/Manifest.txt")
         
         return self
         
     # Run statistics and termtable to create BitFunnel index (config)
-    # This only performs work if needed data is missing
+    # This only performs work if the index for this manifest & parameters is missing
     def build_index(self, density=None, treatment=None):
-    
-        self.config_folder = os.path.join(self.corpus.docs_folder, "config")
-        if not os.path.exists(os.path.join(self.config_folder, "DocFreqTable-0.csv")):
+        self.build_config("config", density, treatment)
+        return self
+
+    # Build a termtable for density & treatment in its own config folder
+    # (config-<density>-<treatment>), sharing the statistics of build_index
+    # This only performs work if the variant's termtable is missing
+    def build_variant(self, density, treatment):
+        self.build_config(variant_name(density, treatment), density, treatment)
+        return self
+
+    # Capture corpus statistics into docs/statistics, unless already captured for the manifest
+    def build_statistics(self):
+        artifacts = self.corpus.artifacts
+        fingerprint = artifacts.fingerprint(manifest=artifacts.manifest_hash(self.corpus.manifest),
+                                            bitfunnel=artifacts.file_hash(self.bf_executable))
+
+        def statistics(folder):
+            self.config_folder = folder
             self.run_statistics()
+            self.corpus.check_last_run()
 
-        if not os.path.exists(os.path.join(self.config_folder, "TermTable-0.bin")):
-            self.build_termtables(density, treatment)
+        artifacts.build(os.path.join(self.corpus.docs_folder, "statistics"), "bfstatistics",
+                        fingerprint, statistics, {"manifest": self.corpus.manifest})
+        return self
 
+    # Build a config folder (docs/<name>) holding the captured statistics
+    # plus the termtable for density & treatment
+    def build_config(self, name, density=None, treatment=None):
+        if density is None:
+            density = DEFAULT_DENSITY
+        if treatment is None:
+            treatment = DEFAULT_TREATMENT
+
+        self.build_statistics()
+        artifacts = self.corpus.artifacts
+        statistics_folder = os.path.join(self.corpus.docs_folder, "statistics")
+        fingerprint = artifacts.fingerprint(statistics=artifacts.fingerprint_of(statistics_folder),
+                                            bitfunnel=artifacts.file_hash(self.bf_executable),
+                                            density=density,
+                                            treatment=treatment)
+
+        def termtables(folder):
+            statistics = os.path.realpath(statistics_folder)
+            for file in os.listdir(statistics):
+                if file != MARKER:
+                    os.symlink(os.path.join(statistics, file), os.path.join(folder, file))
+            self.config_folder = folder
+            self.build_termtables(density, treatment,
+                                  "bf_build_termtables-{0}-{1}.log".format(density, treatment))
+            self.corpus.check_last_run()
+
+        self.config_folder = artifacts.build(os.path.join(self.corpus.docs_folder, name), "bfconfig",
+                                             fingerprint, termtables,
+                                             {"density": density, "treatment": treatment})
         return self
 
+    # Select the termtable variant that run_queries uses (None for the default config)
+    # A running session is restarted with it, as the repl can't change termtables
+    def use_variant(self, density=None, treatment=None):
+        if density is None and treatment is None:
+            self.config_name = "config"
+        else:
+            self.config_name = variant_name(density, treatment)
+        return self.sync_session()
+
     # Capture corpus statistics needed to calculate optimal index
     # This is performed even if it was performed previously
     def run_statistics(self):
@@ -80,26 +176,79 @@ class BitFunnel:
 
     # Build the termtables based on captured statistics
     # This is performed even if it was performed previously
-    def build_termtables(self, density=None, treatment=None):
+    def build_termtables(self, density=None, treatment=None, logfile="bf_build_termtables.log"):
 
         if density==None:
-            density = 0.15
+            density = DEFAULT_DENSITY
         if treatment==None:
-            treatment = "Optimal"
+            treatment = DEFAULT_TREATMENT
 
         # Build termtables (index) for all shards
         args = ("{0} termtable {1} {2} {3}").format(self.bf_executable,
                                                     self.config_folder,
                                                     density,
                                                     treatment)
-        self.corpus.execute(args, "bf_build_termtables.log")
+        self.corpus.execute(args, logfile)
 
         return self
 
+    # Start a repl that ingests the corpus once and stays running, so that
+    # run_queries can reuse the loaded index until stop_session is called
+    # It is placed on cores for query_threads (default: threads), see repl.py
+    def start_session(self, threads=1, query_threads=None):
+        self.stop_session()
+        self.session = ReplSession(self).start(threads, query_threads)
+        return self
+
+    # Restart the running session, if its termtable config isn't the one selected
+    def sync_session(self):
+        if self.session is not None and self.session.config_name != self.config_name:
+            print("Restarting repl session with {0}".format(self.config_name))
+            self.start_session(self.session.threads, self.session.query_threads)
+        return self
+
+    def stop_session(self):
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+        return self
+
+    # Memory (bytes) the repl is given for slice buffers: as set, or else predicted
+    # from the statistics & density of the config queried (None if not built)
+    def memory_estimate(self):
+        if self.memory is not None:
+            return self.memory
+        config_folder = os.path.join(self.corpus.docs_folder, self.config_name)
+        marker = read_marker(os.path.realpath(config_folder))
+        density = DEFAULT_DENSITY
+        if marker is not None and (marker.get("inputs") or {}).get("density") is not None:
+            density = marker["inputs"]["density"]
+        return sizing.bitfunnel_memory(config_folder, density)
+
+    # The repl's -memory option (empty, for BitFunnel's default, if there's no estimate)
+    def memory_option(self):
+        memory = self.memory_estimate()
+        return "" if memory is None else "-memory {0}".format(memory)
+
+    # Files read by run_queries: the termtable config and the chunks the repl loads
+    # (for page cache control & index footprint, see pagecache.py)
+    def index_paths(self):
+        with open(self.corpus.manifest) as file:
+            chunks = [line.strip() for line in file if line.strip()]
+        return [os.path.join(self.corpus.docs_folder, self.config_name)] + chunks
+
     # Run query log using the specified number/range of threads
-    def run_queries(self, querylog, minthreads=1, maxthreads=None):
+    # This uses the running session, if any, else a new repl run from a script
+    # The log is first run warmup times in the same repl (its results dropped)
+    def run_queries(self, querylog, minthreads=1, maxthreads=None, warmup=0):
+
+        if self.session is not None:
+            self.sync_session().session.run_queries(querylog, minthreads, maxthreads, warmup)
+            if self.matches:
+                self.write_matches(querylog, minthreads, maxthreads)
+            return self
 
-        self.config_folder = os.path.join(self.corpus.docs_folder, "config")
+        self.config_folder = os.path.join(self.corpus.docs_folder, self.config_name)
         max = maxthreads  
         if max == None:
             max = minthreads
@@ -112,6 +261,8 @@ class BitFunnel:
             file.write("load manifest {0}\n".format(self.corpus.manifest));
             file.write("status\n");
             file.write("compiler\n");
+            for line in warmup_commands(save_test_folder, os.path.join(self.corpus.data_folder, querylog), max, warmup):
+                file.write(line + "\n")
             for index, thread in enumerate(range(minthreads, max+1)):
                 file.write("threads {0}\n".format(thread))
                 if not maxthreads is None:
@@ -122,55 +273,39 @@ class BitFunnel:
                 file.write("cd {0}\n".format(self.corpus.test_folder))
                 file.write("query log {0}\n".format(os.path.join(self.corpus.data_folder, querylog)))
             file.write("quit\n")
+        self.corpus.test_folder = save_test_folder
 
-        # Start BitFunnel repl
+        # Start BitFunnel repl (its log & metrics go in the test folder, for every thread count)
         args = ("{0} repl {1} -script {2} {3}").format(self.bf_executable,
                                                        self.config_folder,
                                                        self.repl_script,
-                                                       self.memory)
+                                                       self.memory_option())
         self.corpus.execute(args, "bf_run_queries.log")
-
-        self.corpus.test_folder = save_test_folder
+        remove_warmup(save_test_folder)
+        if self.matches:
+            self.write_matches(querylog, minthreads, maxthreads)
         return self
 
-    def analyze_index(self):
-        results = IndexCharacteristics("BitFunnel", self.ingestion_thread_count, self.thread_counts)
-
-        with open(self.bf_run_queries_log, 'r') as myfile:
-            run_queries_log = myfile.read()
-            results.set_float_field("bits_per_posting", "Bits per posting:", run_queries_log)
-            results.set_float_field("total_ingestion_time", "Total ingestion time:", run_queries_log)
-
-        for i, threads in enumerate(self.thread_counts):
-            query_summary_statistics = os.path.join(self.bf_index_path,
-                                                    "results-{0}".format(threads),
-                                                    "QuerySummaryStatistics.txt")
-            with open(query_summary_statistics, 'r') as myfile:
-                data = myfile.read()
-                results.append_float_field("planning_overhead", r"Planning overhead:", data)
-                results.append_float_field("qps", "QPS:", data)
-                results.append_float_field("mps", "MPS:", data)
-                results.append_float_field("mpq", "MPQ:", data)
-                results.append_float_field("mean_query_latency", "Mean query latency:", data)
-
-        self.compute_false_positive_rate(results);
-
-        return results
-
-
-    def analyze_corpus(self, gov2_directories):
-        results = CorpusCharacteristics(gov2_directories, self.min_term_count, self.max_term_count)
-
-        with open(self.bf_build_statistics_log, 'r') as input:
-            build_statistics_log = input.read()
-            results.set_int_field("documents", "Document count:", build_statistics_log)
-            results.set_int_field("terms", "Raw DocumentFrequencyTable count:", build_statistics_log)
-            results.set_int_field("postings", "Posting count:", build_statistics_log)
-            results.set_int_field("bytes", "Total bytes read:", build_statistics_log)
-
-        run_queries_log_file = os.path.join(self.bf_index_path, "results-1", "QuerySummaryStatistics.txt")
-        with open(run_queries_log_file) as input:
-            run_log = input.read()
-            results.set_float_field("matches_per_query", "MPQ:", run_log)
+    # Write QueryMatches.csv (see verify.py) in the test folder of each thread
+    # count, from the running session, or else a repl started for it. The query
+    # log is run again, a query at a time, after the timed run (see repl.py).
+    def write_matches(self, querylog, minthreads=1, maxthreads=None):
+        session = self.sync_session().session or ReplSession(self).start()
+        try:
+            folders = [self.corpus.test_folder]
+            if maxthreads is not None:
+                folders = [self.corpus.test_folder + "_" + str(threads)
+                           for threads in range(minthreads, maxthreads+1)]
+            filename = os.path.join(folders[0], MATCH_FILES['bf'])
+            session.write_matches(querylog, filename)
+            for folder in folders[1:]:
+                shutil.copyfile(filename, os.path.join(folder, MATCH_FILES['bf']))
+        finally:
+            if session is not self.session:
+                session.close()
+        return self
 
-        return results
+# Name of the config folder holding the termtable built for density & treatment
+def variant_name(density, treatment):
+    return "config-{0}-{1}".format(density if density is not None else DEFAULT_DENSITY,
+                                   treatment if treatment is not None else DEFAULT_TREATMENT)
@@ -0,0 +1,207 @@
+# ChunkFilter copies the documents of a manifest's chunks that satisfy a
+# predicate into new chunk files, as an alternative to `bitfunnel filter`.
+#
+# The manifest is split into one shard per worker process (balanced by chunk
+# size). Each worker streams its memory-mapped chunks through the predicate,
+# copying matching document records unchanged into its own output chunks
+# (part-<worker>-<n>.chunk, each up to CHUNK_BYTES), and a fresh Manifest.txt
+# lists them all.
+#
+# Predicates combine with &, | and ~:
+#   PostingCount(256, 4095)          posting count range for each doc (inclusive)
+#   RandomSample(4301, 0.25)         a deterministic random quarter of the docs
+#   DocumentIds([12, 34, ...])       docs with these ids
+#   HasTerms(["whale"], every=True)  docs containing any (or every) term
+#
+# Usage (normally via Corpus.filter_chunks):
+#   filter_chunks(manifest, folder, PostingCount(64, 1024) & RandomSample(1, 0.1), workers)
+
+import abc
+import concurrent.futures
+import os
+
+from chunks import ChunkReader, ChunkWriter
+
+CHUNK_BYTES = 64 << 20
+MASK64 = (1 << 64) - 1
+
+class Predicate(abc.ABC):
+    def __and__(self, other):
+        return Combined("and", self, other)
+
+    def __or__(self, other):
+        return Combined("or", self, other)
+
+    def __invert__(self):
+        return Not(self)
+
+    # Include the document with this id, streams & posting count?
+    @abc.abstractmethod
+    def __call__(self, docid, streams, postings):
+        pass
+
+class Combined(Predicate):
+    def __init__(self, operator, left, right):
+        self.operator = operator
+        self.left = left
+        self.right = right
+
+    def __call__(self, docid, streams, postings):
+        if self.operator == "and":
+            return self.left(docid, streams, postings) and self.right(docid, streams, postings)
+        return self.left(docid, streams, postings) or self.right(docid, streams, postings)
+
+    def __repr__(self):
+        return "({0!r} {1} {2!r})".format(self.left, self.operator, self.right)
+
+class Not(Predicate):
+    def __init__(self, predicate):
+        self.predicate = predicate
+
+    def __call__(self, docid, streams, postings):
+        return not self.predicate(docid, streams, postings)
+
+    def __repr__(self):
+        return "~{0!r}".format(self.predicate)
+
+class PostingCount(Predicate):
+    def __init__(self, minimum, maximum):
+        self.minimum = minimum
+        self.maximum = maximum
+
+    def __call__(self, docid, streams, postings):
+        return self.minimum <= postings <= self.maximum
+
+    def __repr__(self):
+        return "PostingCount({0}, {1})".format(self.minimum, self.maximum)
+
+# Each document is kept with probability fraction, decided by a hash of its
+# id and the seed, so the same seed always selects the same documents
+class RandomSample(Predicate):
+    def __init__(self, seed, fraction):
+        self.seed = seed
+        self.fraction = fraction
+        self.threshold = int(fraction * (1 << 64))
+
+    def __call__(self, docid, streams, postings):
+        return mix64(docid ^ mix64(self.seed)) < self.threshold
+
+    def __repr__(self):
+        return "RandomSample({0}, {1})".format(self.seed, self.fraction)
+
+class DocumentIds(Predicate):
+    def __init__(self, ids):
+        self.ids = frozenset(int(docid) for docid in ids)
+
+    # Ids listed one per line (hex, as in chunk files, if hex is set)
+    @staticmethod
+    def from_file(filename, hex=False):
+        with open(filename) as file:
+            return DocumentIds(int(line, 16 if hex else 10) for line in file if line.strip())
+
+    def __call__(self, docid, streams, postings):
+        return docid in self.ids
+
+    def __repr__(self):
+        return "DocumentIds({0})".format(sorted(self.ids))
+
+class HasTerms(Predicate):
+    def __init__(self, terms, every=False):
+        self.terms = frozenset(term.encode() if isinstance(term, str) else term for term in terms)
+        self.every = every
+
+    def __call__(self, docid, streams, postings):
+        found = set()
+        for streamid, terms in streams:
+            for term in terms:
+                if term in self.terms:
+                    if not self.every:
+                        return True
+                    found.add(term.tobytes())
+        return self.every and len(found) == len(self.terms)
+
+    def __repr__(self):
+        return "HasTerms({0}, every={1})".format(sorted(self.terms), self.every)
+
+# Copy documents satisfying predicate from the manifest's chunks into folder,
+# using a pool of workers (default: one per core), and write folder/Manifest.txt
+# Returns (documents, postings) copied
+def filter_chunks(manifest, folder, predicate, workers=None):
+    workers = workers or os.cpu_count()
+    with open(manifest) as file:
+        chunks = [line.strip() for line in file if line.strip()]
+
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        futures = [pool.submit(filter_shard, shard, folder, "part-{0}".format(index), predicate)
+                   for index, shard in enumerate(balanced_shards(chunks, workers)) if shard]
+        results = [future.result() for future in futures]
+
+    outputs = sorted(output for outputs, documents, postings in results for output in outputs)
+    with open(os.path.join(folder, "Manifest.txt"), 'w') as file:
+        for output in outputs:
+            file.write(output + "\n")
+
+    documents = sum(result[1] for result in results)
+    postings = sum(result[2] for result in results)
+    print("Copied {0} documents, {1} postings into {2} chunks".format(documents, postings, len(outputs)))
+    return documents, postings
+
+# Split chunk files into count shards of about equal total size (largest first)
+def balanced_shards(chunks, count):
+    shards = [[] for i in range(count)]
+    sizes = [0] * count
+    for chunk in sorted(chunks, key=os.path.getsize, reverse=True):
+        smallest = sizes.index(min(sizes))
+        shards[smallest].append(chunk)
+        sizes[smallest] += os.path.getsize(chunk)
+    return [sorted(shard) for shard in shards]
+
+# Worker: filter a shard of chunks into folder/<prefix>-<n>.chunk files
+def filter_shard(chunks, folder, prefix, predicate):
+    output = ShardOutput(folder, prefix)
+    for chunk in chunks:
+        reader = ChunkReader(chunk)
+        copy_matching(reader.records(), predicate, output)
+        reader.close()
+    output.close()
+    return output.files, output.documents, output.postings
+
+# Copy records satisfying predicate to output
+# (kept apart from filter_shard so no views into the chunk outlive this call)
+def copy_matching(records, predicate, output):
+    for docid, streams, record in records:
+        postings = sum(len(terms) for streamid, terms in streams)
+        if predicate(docid, streams, postings):
+            output.write_record(record, postings)
+
+# A worker's output chunks, starting a new one whenever CHUNK_BYTES is reached
+class ShardOutput:
+    def __init__(self, folder, prefix):
+        self.folder = folder
+        self.prefix = prefix
+        self.files = []
+        self.writer = None
+        self.documents = 0
+        self.postings = 0
+
+    def write_record(self, record, postings):
+        if self.writer is None:
+            self.files.append(os.path.join(self.folder, "{0}-{1}.chunk".format(self.prefix, len(self.files))))
+            self.writer = ChunkWriter(self.files[-1])
+        self.writer.write_record(record, postings)
+        self.documents += 1
+        self.postings += postings
+        if self.writer.file.tell() >= CHUNK_BYTES:
+            self.close()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+# 64 bit integer hash (splitmix64 finalizer)
+def mix64(value):
+    value = (value + 0x9E3779B97F4A7C15) & MASK64
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & MASK64
+    return value ^ (value >> 31)
@@ -0,0 +1,294 @@
+# BitFunnel chunk files hold documents as a sequence of null-terminated fields:
+#
+#   Chunk:     Document* '\0'
+#   Document:  DocumentId '\0' Stream* '\0'      (id is 16 hex digits)
+#   Stream:    StreamId '\0' Term* '\0'          (id is 2 hex digits)
+#   Term:      utf-8 text '\0'
+#
+# ChunkWriter writes chunk files (e.g., for ingest.py).
+# ChunkReader memory-maps a chunk file and walks its documents without copying.
+# profile_chunks gathers corpus statistics from chunk files across a process pool.
+# chunk_postings counts the documents & postings of a chunk file.
+
+import collections
+import concurrent.futures
+import hashlib
+import itertools
+import mmap
+import os
+
+import numpy as np
+
+BODY_STREAM = 0
+TITLE_STREAM = 1
+TOP_TERMS = 100000          # Terms listed (by name) in DocumentFrequency.csv
+CHUNK_NAMES = 10000         # Most frequent terms of each chunk sent back by name
+MERGE_ENTRIES = 1 << 24     # Term counts gathered before they are merged
+PROFILE_BATCH = 16          # Chunks profiled (and merged) per worker task
+
+class ChunkWriter:
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename + ".tmp", 'wb', buffering=1 << 20)
+        self.documents = 0
+        self.postings = 0
+
+    # Write one document: streams is a list of (stream id, list of terms as bytes)
+    def write_document(self, docid, streams):
+        parts = [b"%016x" % docid]
+        for streamid, terms in streams:
+            parts.append(b"%02x" % streamid)
+            parts.extend(terms)
+            parts.append(b"")
+            self.postings += len(terms)
+        parts.append(b"")
+        self.file.write(b"\0".join(parts) + b"\0")
+        self.documents += 1
+
+    # Write a document record read by ChunkReader.records, as is
+    def write_record(self, record, postings):
+        self.file.write(record)
+        self.postings += postings
+        self.documents += 1
+
+    # Terminate the chunk, then move it into place, so a partly written chunk
+    # never appears under its final name
+    def close(self):
+        self.file.write(b"\0")
+        self.file.close()
+        os.replace(self.filename + ".tmp", self.filename)
+
+class ChunkReader:
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b"\0"
+
+    # Yield (document id, streams) for each document, where streams is a list of
+    # (stream id, terms) and terms are memoryviews into the mapped file.
+    # The views are only valid until close(), so copy any that must outlive it.
+    def documents(self):
+        for docid, streams, record in self.records():
+            yield docid, streams
+
+    # Like documents, also yielding a view of the document's whole record
+    # (which can be written to another chunk unchanged)
+    def records(self):
+        view = memoryview(self.data)
+        find = self.data.find
+        start = 0
+
+        # Each field runs from the end of the previous field to its own null
+        # (found by scanning the map, so memory stays constant per field)
+        def next_field():
+            nonlocal start
+            end = find(b"\0", start)
+            if end < 0:
+                raise StopIteration
+            field = view[start:end]
+            start = end + 1
+            return field
+
+        try:
+            while True:
+                record_start = start
+                docid = next_field()
+                if not docid:
+                    break
+                streams = []
+                while True:
+                    streamid = next_field()
+                    if not streamid:
+                        break
+                    terms = []
+                    while True:
+                        term = next_field()
+                        if not term:
+                            break
+                        terms.append(term)
+                    streams.append((int(bytes(streamid), 16), terms))
+                yield int(bytes(docid), 16), streams, view[record_start:start]
+        except StopIteration:
+            raise ValueError("Truncated chunk file {0}".format(self.filename))
+        finally:
+            view.release()
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+# Statistics gathered from chunk files by profile_chunks
+# Terms are counted by a 64 bit hash, so each chunk's counts travel back from
+# its worker as two arrays and are merged in batches with np.unique. Only
+# the most frequent terms (those DocumentFrequency.csv lists) are kept by name.
+class ChunkProfile:
+    def __init__(self):
+        self.documents = 0
+        self.postings = 0
+        self.posting_counts = np.zeros(1, dtype=np.int64)          # documents by number of postings
+        self.term_hashes = np.empty(0, dtype=np.uint64)            # hash of each term (sorted)
+        self.document_frequency = np.empty(0, dtype=np.int64)      # number of documents of each term
+        self.names = {}                                            # hash -> term, for frequent terms
+        self.pending = []                                          # (hashes, frequencies) to merge
+
+    # Fold in the profile of other chunks
+    def add(self, other):
+        self.documents += other.documents
+        self.postings += other.postings
+        size = max(len(self.posting_counts), len(other.posting_counts))
+        counts = np.zeros(size, dtype=np.int64)
+        counts[:len(self.posting_counts)] += self.posting_counts
+        counts[:len(other.posting_counts)] += other.posting_counts
+        self.posting_counts = counts
+        self.pending.append((other.term_hashes, other.document_frequency))
+        self.pending.extend(other.pending)
+        self.names.update(other.names)
+        if sum(len(hashes) for hashes, frequencies in self.pending) > MERGE_ENTRIES:
+            self.merge()
+        return self
+
+    # Merge the pending term counts (keeping the names of the most frequent terms only)
+    def merge(self):
+        if self.pending:
+            hashes = np.concatenate([self.term_hashes] + [hashes for hashes, frequencies in self.pending])
+            frequencies = np.concatenate([self.document_frequency]
+                                         + [frequencies for hashes, frequencies in self.pending])
+            self.term_hashes, inverse = np.unique(hashes, return_inverse=True)
+            self.document_frequency = np.bincount(inverse, weights=frequencies).astype(np.int64)
+            self.pending = []
+            if len(self.names) > 2 * TOP_TERMS:
+                keep = set(self.term_hashes[self.top(2 * TOP_TERMS)].tolist())
+                self.names = {key: name for key, name in self.names.items() if key in keep}
+        return self
+
+    def term_count(self):
+        return len(self.merge().term_hashes)
+
+    # Positions (in term_hashes) of the count most frequent terms, most frequent first
+    def top(self, count):
+        self.merge()
+        return np.argsort(-self.document_frequency, kind="stable")[:count]
+
+    # Write a summary, the posting count histogram and the document frequency
+    # of the top most frequent terms (most frequent first) to folder
+    def write(self, folder, min_frequency=1, top=TOP_TERMS):
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        with open(os.path.join(folder, "Profile.txt"), 'w') as file:
+            file.write("Document count: {0}\n".format(self.documents))
+            file.write("Posting count: {0}\n".format(self.postings))
+            file.write("Term count: {0}\n".format(self.term_count()))
+        with open(os.path.join(folder, "PostingCountHistogram.csv"), 'w') as file:
+            file.write("postings,documents\n")
+            for postings in np.flatnonzero(self.posting_counts):
+                file.write("{0},{1}\n".format(postings, self.posting_counts[postings]))
+        with open(os.path.join(folder, "DocumentFrequency.csv"), 'w') as file:
+            file.write("term,documents,frequency\n")
+            for position in self.top(top):
+                count = int(self.document_frequency[position])
+                if count < min_frequency:
+                    break
+                name = self.names.get(int(self.term_hashes[position]), b"#%016x" % self.term_hashes[position])
+                file.write("{0},{1},{2:.6g}\n".format(name.decode(errors="replace"), count,
+                                                        count / self.documents))
+        return self
+
+# 64 bit hash of a term
+def term_hash(term):
+    return int.from_bytes(hashlib.blake2b(term, digest_size=8).digest(), "little")
+
+# Profile of one chunk file
+def profile_chunk(filename):
+    reader = ChunkReader(filename)
+    profile = profile_documents(reader.documents())
+    reader.close()
+    return profile
+
+# Profile of documents from ChunkReader.documents
+# (kept apart from profile_chunk so no views into the file outlive this call)
+def profile_documents(documents):
+    profile = ChunkProfile()
+    posting_counts = []
+    frequency = collections.Counter()
+    for docid, streams in documents:
+        # A term appearing in several streams is a posting in each
+        postings = 0
+        unique = set()
+        for streamid, terms in streams:
+            postings += len(terms)
+            unique.update(term.tobytes() for term in terms)
+        posting_counts.append(postings)
+        frequency.update(unique)
+
+    profile.documents = len(posting_counts)
+    profile.postings = sum(posting_counts)
+    profile.posting_counts = np.bincount(np.array(posting_counts, dtype=np.int64), minlength=1)
+    hashes = np.array([term_hash(term) for term in frequency], dtype=np.uint64)
+    order = np.argsort(hashes)
+    profile.term_hashes = hashes[order]
+    profile.document_frequency = np.array(list(frequency.values()), dtype=np.int64)[order]
+    profile.names = {term_hash(term): term for term, count in frequency.most_common(CHUNK_NAMES)}
+    return profile
+
+# Names of the terms of a chunk file with these hashes
+def chunk_term_names(filename, wanted):
+    reader = ChunkReader(filename)
+    names = find_names(reader.documents(), wanted)
+    reader.close()
+    return names
+
+def find_names(documents, wanted):
+    names = {}
+    seen = set()
+    for docid, streams in documents:
+        for streamid, terms in streams:
+            for term in terms:
+                term = term.tobytes()
+                if term not in seen:
+                    seen.add(term)
+                    key = term_hash(term)
+                    if key in wanted:
+                        names[key] = term
+    return names
+
+# (documents, postings) in one chunk file, a quicker count than profile_chunk
+def chunk_postings(filename):
+    reader = ChunkReader(filename)
+    counts = count_postings(reader.documents())
+    reader.close()
+    return counts
+
+def count_postings(documents):
+    count = postings = 0
+    for docid, streams in documents:
+        count += 1
+        postings += sum(len(terms) for streamid, terms in streams)
+    return count, postings
+
+# Profile all chunk files listed in a manifest, using a pool of worker processes
+def profile_chunks(manifest, workers=None):
+    with open(manifest) as file:
+        chunks = [line.strip() for line in file if line.strip()]
+    profile = ChunkProfile()
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        # Profiles are folded together in the workers, a batch of chunks at a time
+        batches = [chunks[i:i + PROFILE_BATCH] for i in range(0, len(chunks), PROFILE_BATCH)]
+        for batch_profile in pool.map(profile_batch, batches):
+            profile.add(batch_profile)
+
+        # Frequent terms no chunk ranked among its own most frequent are named by a second pass
+        missing = frozenset(int(key) for key in profile.term_hashes[profile.top(TOP_TERMS)]
+                            if int(key) not in profile.names)
+        if missing:
+            for names in pool.map(chunk_term_names, chunks, itertools.repeat(missing)):
+                profile.names.update(names)
+    return profile
+
+# Profile of a list of chunk files, merged in the worker
+def profile_batch(chunks):
+    profile = ChunkProfile()
+    for chunk in chunks:
+        profile.add(profile_chunk(chunk))
+    return profile.merge()
@@ -4,21 +4,60 @@
 # "Data Folder"          data_folder (e.g., "wikipedia" or "gov2")
 # |-- docs               docs_folder (location of all document corpus & index data)
 #     |-- manifest.txt     manifest (File listing all chunk files)
+#     |-- queries          Query logs prepared for each engine (see querylogs.py)
 #     |-- chunks           chunks_folder (Bitfunnel chunk files)
+#     |-- statistics       Bitfunnel corpus statistics
 #     |-- config           Bitfunnel folder (for statistics and termtables)
 #     |-- mg4jindex        MG4J index folder
 #     |-- pefindex         PEF index folder
 # |-- "experiment"       test_folder (location to place query results & logs)
+# |-- artifacts          Built indexes & chunk copies, by fingerprint of their inputs
+#                        (the index folders in docs link to these; see artifacts.py)
 #
 # Things you can do with corpus after establishing one:
 # .set_chunks_folder(folder, manifest)       # change default "chunks" and "manifest.txt"
 # .set_test_name(name)                       # Start a new experiment / test folder
+# .ingest_gov2(gov2_folder, workers)         # Create chunks & manifest from raw GOV2 files
+# .profile(workers)                          # Document, posting & term counts of the chunks
+# .filter_chunks(newfolder, predicate)       # Copy the docs satisfying predicate to a new docs folder
+# .shard(index, chunks)                      # Corpus & engines for a subset of chunks (see shards.py)
+# .set_quiet(quiet)                          # Log engine output without echoing it
+# .set_cache_mode(mode)                      # Run queries on a "cold" or "warm" page cache
+# .set_placement(placement)                  # Pin query runs to cores & NUMA nodes
+# .build_indexes(cores, memory)              # Build all engine indexes in parallel
+# .prepare_queries(querylog, dedupe)         # Normalize a query log for every engine's format
+# .run_queries(querylog, minthreads, maxthreads, warmup, repetitions)
+#                                            # Run queries on all engines (repeatedly, to benchmark)
+# .analyze(minthreads, maxthreads)           # Summarize query results (see results.py)
+# .document_ids()                            # Document id of each document, in manifest order
 
+import copy
 import os
+import random
 import re
 import subprocess
+import sys
+import threading
+import time
 from datetime import datetime
 
+import numpy as np
+
+import chunkfilter
+import ingest
+import pagecache
+import querylogs
+import sizing
+import verify
+from artifacts import MARKER, ArtifactCache
+from chunks import profile_chunks
+from metrics import ResourceMonitor
+from placement import pinned_command
+from results import Results, repetition_summary
+from scheduler import Scheduler
+
+LOG_BUFFER_SIZE = 1 << 20
+
 class Corpus:
     def __init__(self,
                  data_folder,         # Location of corpus folder & where to put results
@@ -26,28 +65,119 @@ class Corpus:
 
         self.data_folder = data_folder
         self.mg4j_jar = os.path.join(mg4j_workbench, "target", "mg4j-1.0-SNAPSHOT.jar")
+        self.mg4j_heap = "16g"    # Java heap for MG4J builds (query runs are sized, see sizing.py)
+        self.quiet = False
+        self.last_metrics = None
+        self.repetitions = 1
+        self.benchmarked = False  # Were the last queries run in repetition folders?
+        self.cache_mode = None
+        self.placement = None
+        self.run_context = {}     # Describes the next engine run, for its metrics
+        self.cached_document_ids = (None, None)     # (manifest fingerprint, ids)
+        self.artifacts = ArtifactCache(os.path.join(self.data_folder, "artifacts"))
 
         self.docs_folder = os.path.join(self.data_folder, "docs")
         self.set_chunks_folder("chunks", "manifest.txt")
         self.set_test_name("experiment")
 
         self.engines = {}
+        self.query_logs = {}      # raw query log -> {query format: prepared log}
 
     # Set the folder (in docs) & manifest file for the document chunks
-    # Create manifest file listing all chunk files, if it does not exist
+    # Create manifest file listing all chunk files, if it does not exist,
+    # or recreate it if the chunk files have changed since it was created
     def set_chunks_folder(self, folder, manifest=None):
         self.chunks_folder = os.path.join(self.docs_folder, folder)
 
         if manifest is None:
             manifest = folder + "_manifest.txt"
         self.manifest = os.path.join(self.docs_folder, manifest)
-        if not os.path.exists(self.manifest):
-            args = ("find {0} -type f > {1}").format(self.chunks_folder,
-                                                 self.manifest)
-            self.execute(args, None)
+
+        # The fingerprint of the listed chunks is kept beside a manifest we create.
+        # Manifests without one (e.g., written by BitFunnel filter) are left alone.
+        stamp = self.manifest + ".fingerprint"
+        if os.path.exists(self.manifest) and not os.path.exists(stamp):
+            return self
+        chunks = sorted(os.path.join(root, f)
+                        for root, dirs, files in os.walk(self.chunks_folder)
+                        for f in files)
+        # (the manifest, its stamp & temporary files may be in the chunks folder)
+        chunks = [chunk for chunk in chunks
+                  if chunk not in (self.manifest, stamp)
+                  and os.path.basename(chunk) != MARKER and not chunk.endswith(".tmp")]
+        fingerprint = self.artifacts.files_hash(chunks)
+        if os.path.exists(self.manifest):
+            with open(stamp) as file:
+                if file.read() == fingerprint:
+                    return self
+            print("Chunks changed since {0} was written".format(self.manifest))
+
+        print("Writing manifest {0}".format(self.manifest))
+        os.makedirs(os.path.dirname(self.manifest), exist_ok=True)
+        with open(self.manifest + ".tmp", 'w') as file:
+            for chunk in chunks:
+                file.write(chunk + '\n')
+        with open(stamp, 'w') as file:
+            file.write(fingerprint)
+        os.replace(self.manifest + ".tmp", self.manifest)
 
         return self
 
+    # Create BitFunnel chunk files (in docs/chunks) & manifest.txt from the raw
+    # GOV2 collection, using a pool of workers (see ingest.py)
+    # This only performs work if they weren't created from the same GOV2 files
+    def ingest_gov2(self, gov2_folder, workers=None):
+        fingerprint = self.artifacts.fingerprint(
+            bundles=self.artifacts.files_hash(ingest.gov2_bundles(gov2_folder)),
+            ingest=self.artifacts.file_hash(ingest.__file__))
+        self.artifacts.build(os.path.join(self.docs_folder, "chunks"), "gov2chunks", fingerprint,
+                             lambda folder: ingest.ingest_gov2(gov2_folder, folder, workers),
+                             {"gov2": gov2_folder})
+
+        return self.set_chunks_folder("chunks", "manifest.txt")
+
+    # Create a copy of the corpus chunks (in <newfolder>/chunks) holding the documents
+    # that satisfy predicate, using a pool of workers (see chunkfilter.py)
+    # Example: corpus.filter_chunks("docs-small", PostingCount(64, 1024) & RandomSample(1, 0.1))
+    # This only performs work if no copy was made from the same chunks & predicate
+    def filter_chunks(self, newfolder, predicate, workers=None):
+        fingerprint = self.artifacts.fingerprint(manifest=self.artifacts.manifest_hash(self.manifest),
+                                                 filter=repr(predicate),
+                                                 code=self.artifacts.file_hash(chunkfilter.__file__))
+        source_manifest = self.manifest
+        self.docs_folder = os.path.join(self.data_folder, newfolder)
+        self.artifacts.build(os.path.join(self.docs_folder, "chunks"), "chunks", fingerprint,
+                             lambda folder: chunkfilter.filter_chunks(source_manifest, folder, predicate, workers),
+                             {"manifest": source_manifest, "filter": repr(predicate)})
+
+        return self.set_chunks_folder("chunks", "chunks/Manifest.txt")
+
+    # A copy of the corpus holding just the given chunk files, as shard index of a
+    # sharded corpus (see shards.py), with a copy of each registered engine.
+    # Its docs are in <docs_folder>-shards/shard<index>, its results in
+    # <test_folder>-shard<index>.
+    def shard(self, index, chunks):
+        shard = copy.copy(self)
+        shard.engines = {}
+        shard.query_logs = {}
+        shard.docs_folder = os.path.join(self.docs_folder + "-shards", "shard{0}".format(index))
+        shard.manifest = os.path.join(shard.docs_folder, "manifest.txt")
+        contents = "".join(chunk + "\n" for chunk in chunks)
+        if os.path.exists(shard.manifest):
+            with open(shard.manifest) as file:
+                if file.read() == contents:
+                    contents = None
+        if contents is not None:
+            print("Writing manifest {0}".format(shard.manifest))
+            os.makedirs(shard.docs_folder, exist_ok=True)
+            with open(shard.manifest + ".tmp", 'w') as file:
+                file.write(contents)
+            os.replace(shard.manifest + ".tmp", shard.manifest)
+        shard.set_test_folder("{0}-shard{1}".format(self.test_folder, index))
+        for engine in self.engines.values():
+            engine.for_corpus(shard)
+        return shard
+
     # Build manifest.txt from chunks in folder based on filename match to regular expression
     def create_manifest_from_pattern(self, name, chunk_pattern):
         self.manifest = os.path.join(self.docs_folder, name)
@@ -55,10 +185,10 @@ class Corpus:
             return self
 
         regex = re.compile(chunk_pattern)
-        chunks = [os.path.join(self.chunks_folder, f)
-                  for root, dirs, files in os.walk(self.chunk_dir)
-                  for f in files
-                  if regex.search(f) is not None]
+        chunks = sorted(os.path.join(root, f)
+                        for root, dirs, files in os.walk(self.chunks_folder)
+                        for f in files
+                        if regex.search(f) is not None)
 
         for chunk in chunks:
             print(chunk)
@@ -69,36 +199,239 @@ class Corpus:
                 file.write(chunk + '\n')
         return self
 
+    # Count documents, postings per document and term document frequencies of the
+    # manifest's chunks across a pool of workers (see chunks.py), a quick
+    # alternative to BitFunnel statistics for sizing corpora & choosing filters.
+    # Results are written to the <manifest>_profile folder.
+    def profile(self, workers=None):
+        profile = profile_chunks(self.manifest, workers)
+        profile.write(os.path.splitext(self.manifest)[0] + "_profile")
+        print("{0} documents, {1} postings, {2} terms".format(profile.documents,
+                                                             profile.postings,
+                                                             profile.term_count()))
+        return profile
+
+    # Stop (or resume) echoing engine output to the console. Output is still logged.
+    def set_quiet(self, quiet=True):
+        self.quiet = quiet
+        return self
+
+    # Run queries with each engine's index evicted from the page cache ("cold"),
+    # read into it ("warm"), or as they happen to be (None). See pagecache.py.
+    # Either way, the index footprint is recorded in the run's metrics, beside
+    # the bytes read from storage (block_reads, in 512 byte blocks).
+    def set_cache_mode(self, mode):
+        if mode not in pagecache.CACHE_MODES:
+            raise ValueError("Unknown cache mode {0} (expected one of {1})".format(mode, pagecache.CACHE_MODES))
+        self.cache_mode = mode
+        return self
+
+    # Pin every engine query run to cores (and NUMA node) chosen by a placement
+    # policy, e.g., Placement(node=0) (see placement.py), or stop pinning (None).
+    # The cores & nodes used are recorded in the run's metrics.
+    def set_placement(self, placement):
+        self.placement = placement
+        return self
+
     # Set the name of the current test experiment
     def set_test_name(self, name):
-        self.test_folder = os.path.join(self.data_folder, name)
+        return self.set_test_folder(os.path.join(self.data_folder, name))
+
+    # Set the folder of the current test experiment
+    def set_test_folder(self, folder):
+        self.test_folder = folder
         if not os.path.exists(self.test_folder):
              os.makedirs(self.test_folder)
         return self
 
+    # Build the indexes of all registered engines, running independent builds in
+    # parallel worker processes within a budget of cores and memory (GB).
+    # An engine's build starts only after the builds it requires have succeeded.
+    def build_indexes(self, cores=None, memory=None):
+        scheduler = Scheduler(cores, memory)
+        for engtype, engine in self.engines.items():
+            scheduler.add_job(engtype,
+                              engine.build_index,
+                              engine.build_requires,
+                              engine.build_cores,
+                              engine.build_memory)
+        failed = scheduler.run()
+        if failed:
+            print("Index builds failed: {0}".format(", ".join(failed)))
+
+        return self
+
+    # Normalize a raw query log once (dropping empty queries, repeated queries if
+    # dedupe is set, and queries with terms missing from the MG4J index, if built),
+    # writing it in each engine's query format (see querylogs.py).
+    # run_queries then gives each engine the prepared log in its format.
+    # This only performs work if the log wasn't prepared for the same index.
+    def prepare_queries(self, querylog, dedupe=True):
+        raw_log = os.path.join(self.data_folder, querylog)
+        name = os.path.basename(raw_log)
+        mg4jindex = os.path.join(self.docs_folder, "mg4jindex")
+        terms_file = None
+        if self.artifacts.fingerprint_of(mg4jindex) is not None:
+            terms_file = querylogs.terms_file(mg4jindex)
+
+        fingerprint = self.artifacts.fingerprint(log=self.artifacts.file_hash(raw_log),
+                                                 mg4jindex=self.artifacts.fingerprint_of(mg4jindex),
+                                                 dedupe=dedupe,
+                                                 code=self.artifacts.file_hash(querylogs.__file__))
+
+        def prepare(folder):
+            terms = querylogs.TermDictionary.load(terms_file) if terms_file is not None else None
+            querylogs.prepare_query_log(raw_log, folder, terms, dedupe)
+
+        folder = os.path.join(self.docs_folder, "queries", name)
+        self.artifacts.build(folder, "queries", fingerprint, prepare, {"log": raw_log})
+        self.query_logs[querylog] = {format: os.path.join(folder, name + "." + format)
+                                     for format in querylogs.FORMATS
+                                     if os.path.exists(os.path.join(folder, name + "." + format))}
+        return self
+
+    # The query log an engine should run: the prepared log in the engine's
+    # format if prepare_queries was used, otherwise querylog unchanged
+    def query_log_for(self, querylog, engine):
+        prepared = self.query_logs.get(querylog)
+        if prepared is None:
+            return querylog
+        if engine.query_format not in prepared:
+            raise RuntimeError("No {1} log was prepared for {0} (is the MG4J index built?)".format(
+                querylog, engine.query_format))
+        return prepared[engine.query_format]
+
+    # Document id of each document in manifest order (MG4J numbers documents by
+    # this position, see verify.py), kept as an artifact of the manifest
+    def document_ids(self):
+        fingerprint = self.artifacts.fingerprint(manifest=self.artifacts.manifest_hash(self.manifest))
+        if self.cached_document_ids[0] != fingerprint:
+            def save(folder):
+                np.save(os.path.join(folder, "docids.npy"), verify.document_ids(self.manifest))
+
+            folder = self.artifacts.build(os.path.join(self.docs_folder, "docids"), "docids", fingerprint, save,
+                                          {"manifest": self.manifest})
+            self.cached_document_ids = (fingerprint, np.load(os.path.join(folder, "docids.npy")))
+        return self.cached_document_ids[1]
+
     # Run query log across all registered engines, putting results in test_folder
     # If maxthreads is specified, the query is run multiple times varying threads
     #   Results for each thread attempts are captured in a different test folder
-    def run_queries(self, querylog, minthreads=1, maxthreads=None):
-    
-        for engtype, engine in self.engines.items():
-            # Bitfunnel runs all thread tests at same time
-            if engtype == 'bf':
-                engine.run_queries(querylog, minthreads, maxthreads)
-            elif maxthreads is None:
-                engine.run_queries(querylog, minthreads)
-            else:
-                save_test_folder = self.test_folder
-                for index, threads in enumerate(range(minthreads, maxthreads+1)):
-                    self.test_folder = save_test_folder + "_" + str(threads)
-                    if not os.path.exists(self.test_folder):
-                        print("mkdir " + self.test_folder)
-                        os.makedirs(self.test_folder)
-                    engine.run_queries(querylog, threads)
-                self.test_folder = save_test_folder
+    # For benchmarking, the whole log is run repetitions times, each in
+    # <test_folder>-rep<n> (even if there is only one). Each engine process first
+    # runs the log warmup times itself, its results dropped, so what is measured
+    # has warm caches and (for MG4J's JVM) compiled code; see the engines'
+    # run_queries. Engines run in a random order (by seed) in every repetition, so
+    # none is always measured right after the same other engine (or a cold start).
+    # Warmup reads the index in, so a "cold" cache mode measures only the first pass.
+    def run_queries(self, querylog, minthreads=1, maxthreads=None, warmup=0, repetitions=1, seed=None):
+        self.repetitions = repetitions
+        self.benchmarked = bool(warmup) or repetitions > 1
+        if not self.benchmarked:
+            for engtype, engine in self.engines.items():
+                self.run_engine_queries(engtype, engine, querylog, minthreads, maxthreads)
+            return self
+
+        order = random.Random(seed)
+        save_test_folder = self.test_folder
+        for n in range(1, repetitions + 1):
+            engines = list(self.engines.items())
+            order.shuffle(engines)
+            print("Benchmark repetition {0}: {1}".format(n, ", ".join(engtype for engtype, engine in engines)))
+            self.test_folder = repetition_folder(save_test_folder, n)
+            if not os.path.exists(self.test_folder):
+                os.makedirs(self.test_folder)
+            for engtype, engine in engines:
+                self.run_engine_queries(engtype, engine, querylog, minthreads, maxthreads, warmup)
+        self.test_folder = save_test_folder
 
         return self
 
+    # Run query log on one engine, for the specified number/range of threads
+    # (after warmup runs of it in the same process)
+    def run_engine_queries(self, engtype, engine, querylog, minthreads=1, maxthreads=None, warmup=0):
+        enginelog = self.query_log_for(querylog, engine)
+        # Bitfunnel runs all thread tests at same time
+        if engtype == 'bf':
+            self.prepare_run(engine, maxthreads or minthreads)
+            engine.run_queries(enginelog, minthreads, maxthreads, warmup)
+        elif maxthreads is None:
+            self.prepare_run(engine, minthreads)
+            engine.run_queries(enginelog, minthreads, warmup)
+        else:
+            save_test_folder = self.test_folder
+            for index, threads in enumerate(range(minthreads, maxthreads+1)):
+                self.test_folder = save_test_folder + "_" + str(threads)
+                if not os.path.exists(self.test_folder):
+                    print("mkdir " + self.test_folder)
+                    os.makedirs(self.test_folder)
+                self.prepare_run(engine, threads)
+                engine.run_queries(enginelog, threads, warmup)
+            self.test_folder = save_test_folder
+        self.run_context = {}
+
+        return self
+
+    # Put the engine's index files in the page cache state of the cache mode, and
+    # note the mode, index footprint and query threads (to place the run on cores)
+    # for the metrics of the engine's next run
+    def prepare_run(self, engine, threads):
+        files = pagecache.index_files(engine.index_paths())
+        pagecache.prepare(files, self.cache_mode)
+        self.run_context = {"cache_mode": self.cache_mode,
+                            "index_files": len(files),
+                            "index_bytes": pagecache.footprint(files),
+                            "predicted_memory": engine.memory_estimate(),
+                            "threads": threads}
+
+    # Parse the query results of all engines (for the same threads given to run_queries)
+    # BitFunnel's (and the signature engine's) matches are verified against MG4J, PEF
+    # or an exact signature engine, when their match files exist (BitFunnel writes
+    # one if created with matches=True, the signature engines always do, see verify.py)
+    # A summary per engine & thread count is printed and saved as summary.csv
+    # After a benchmark run (with warmup or repetitions), each repetition is summarized in its own folder, and the
+    # mean, median & confidence interval of QPS and latency across repetitions are
+    # printed and saved as benchmark.csv (flagging those varying more than max_cv).
+    # Returns the Results (a list of them, one per repetition, after a benchmark run).
+    def analyze(self, minthreads=1, maxthreads=None, repetitions=None, confidence=0.95, max_cv=0.05):
+        benchmarked = self.benchmarked or (repetitions or 1) > 1
+        repetitions = repetitions or self.repetitions
+        if not benchmarked:
+            return self.analyze_folder(self.test_folder, minthreads, maxthreads)[0]
+
+        analyzed = [self.analyze_folder(repetition_folder(self.test_folder, n), minthreads, maxthreads)
+                    for n in range(1, repetitions + 1)]
+        benchmark = repetition_summary([summary for results, summary in analyzed], confidence, max_cv)
+        benchmark.write_csv(os.path.join(self.test_folder, "benchmark.csv"))
+        print(benchmark)
+        flagged = [row for row in benchmark.rows() if row["high_variance"]]
+        for row in flagged:
+            print("High variance: {0} with {1} threads (QPS cv {2:.3g}, latency cv {3:.3g})".format(
+                row["engine"], row["threads"], row["qps_cv"], row["latency_cv"]))
+        return [results for results, summary in analyzed]
+
+    # Results & summary of the query results in one test folder
+    def analyze_folder(self, test_folder, minthreads=1, maxthreads=None):
+        results = Results(self).load(minthreads, maxthreads, test_folder=test_folder)
+        folder = results.folders[0][1]
+        references = [engtype for engtype in ('mg4j', 'pef', 'sigexact') if engtype in self.engines]
+        for engtype in ('bf', 'sig'):
+            if engtype not in self.engines:
+                continue
+            others = [reference for reference in references if reference != engtype]
+            candidates = [reference for reference in others if verify.has_matches(folder, reference)]
+            if not others:
+                continue
+            if not verify.has_matches(folder, engtype) or not candidates:
+                print("Not verifying {0}: no per-query matches of it and of an exact engine in {1} "
+                      "(see verify.py)".format(engtype, folder))
+                continue
+            results.verify(candidates[0], engine=engtype)
+        summary = results.summary()
+        summary.write_csv(os.path.join(test_folder, "summary.csv"))
+        print(summary)
+        return results, summary
+
 # --------- "Internal" methods, used by engines
 
     # Register a ready-to-use search engine
@@ -107,31 +440,65 @@ class Corpus:
         return self
 
     # Perform command "args" in a subprocess
+    # stdout and stderr are drained at the same time into buffered, timestamped
+    # log records, so an engine writing a lot to either pipe never stalls on it.
+    # Output is echoed to the console as well, unless the corpus is quiet.
+    # Wall time, CPU, memory and I/O used are saved next to the log (see metrics.py).
+    # Engine query runs are pinned to cores if a placement is set.
     def run(self, args, working_directory, logfile = None):
+        args, extra = self.placed_command(args)
+
+        sys.stdout.flush()
         proc = subprocess.Popen(args, cwd=working_directory, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True);
+        monitor = ResourceMonitor(proc.pid).start()
 
+        log = None
         if logfile is not None:
-            with open(os.path.join(self.test_folder, logfile), 'w') as log:
-                print("Running {0} at {1}\n".format(args, str(datetime.now())), end='', file = log)
-                for line in proc.stdout:
-                    print(line.decode(), end='', file = log)
-                    print(line.decode(), end='')
-                for line in proc.stderr:
-                    print(line.decode(), end='', file = log)
-                    print(line.decode(), end='')
-        else:
-            for line in proc.stdout:
-                print(line.decode(), end='')
-            for line in proc.stderr:
-                print(line.decode(), end='')
+            log = open(os.path.join(self.test_folder, logfile), 'wb', buffering=LOG_BUFFER_SIZE)
+            log.write("Running {0} at {1}\n".format(args, str(datetime.now())).encode())
+        echo = None if self.quiet else sys.stdout.buffer
+        lock = threading.Lock()
+        started = time.time()
 
-        proc.stdout.close()
-        returncode = proc.wait()
+        pumps = [threading.Thread(target=pump, args=(proc.stdout, b"out", log, echo, lock, started)),
+                 threading.Thread(target=pump, args=(proc.stderr, b"err", log, echo, lock, started))]
+        for thread in pumps:
+            thread.start()
+        for thread in pumps:
+            thread.join()
+        returncode = monitor.wait()
+        proc.returncode = returncode
+
+        # Record resource usage in a metrics file next to the log
+        extra.update(command=args, logfile=logfile)
+        if log is not None:
+            log.close()
+            metrics_file = os.path.splitext(os.path.join(self.test_folder, logfile))[0] + ".metrics.json"
+            self.last_metrics = monitor.save(metrics_file, extra)
+        else:
+            self.last_metrics = dict(extra, **monitor.report())
 
         # Ensure we don't get zombie processes. This had been a problem with the 7z decompression.
         del proc
         return returncode
 
+    # Command args pinned to cores for the next engine run, if a placement is
+    # set, and the metrics that describe that run (see prepare_run)
+    def placed_command(self, args):
+        extra = dict(self.run_context)
+        if self.placement is not None and "threads" in self.run_context:
+            plan = self.placement.place(self.run_context["threads"])
+            args = pinned_command(args, plan)
+            extra["placement"] = plan.describe()
+        return args, extra
+
+    # Raise an exception if the last command run failed. Builds use this so that
+    # a failed build is never committed as a complete artifact.
+    def check_last_run(self):
+        if self.last_metrics["returncode"] != 0:
+            raise RuntimeError("Failed ({0} return code): {1}".format(self.last_metrics["returncode"],
+                                                                      self.last_metrics["command"]))
+
     # Execute command and log its results in log file
     def execute(self, command, logfile = None):
         print(command)
@@ -139,6 +506,26 @@ class Corpus:
         print("Finished: {0} return code\n".format(rc))
         return rc
 
-    def mg4j_execute(self, command, logfile = None):
-        return self.execute("java -cp {0} -Dfile.encoding=UTF-8 -Xmx16g {1}".format(self.mg4j_jar, command),
-                            logfile)
\ No newline at end of file
+    # Execute an MG4J class with a heap of heap bytes (default: mg4j_heap)
+    def mg4j_execute(self, command, logfile = None, heap = None):
+        heap_option = sizing.java_heap_option(heap) if heap is not None else "-Xmx" + self.mg4j_heap
+        return self.execute("java -cp {0} -Dfile.encoding=UTF-8 {1} {2}".format(self.mg4j_jar, heap_option, command),
+                            logfile)
+
+# The test folder holding repetition n of a benchmark run in test_folder
+def repetition_folder(test_folder, n):
+    return "{0}-rep{1}".format(test_folder, n)
+
+# Copy lines from a subprocess pipe until it closes, into log records stamped
+# with seconds since the process started and the stream they came from
+def pump(stream, name, log, echo, lock, started):
+    for line in iter(stream.readline, b""):
+        if log is not None:
+            stamp = "{0:.3f} ".format(time.time() - started).encode()
+            with lock:
+                log.write(stamp + name + b" " + line)
+        if echo is not None:
+            with lock:
+                echo.write(line)
+                echo.flush()
+    stream.close()
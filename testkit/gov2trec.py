@@ -9,15 +9,15 @@ corpus = Corpus( r"/bf/data/gov2",
                  r"/bf/git/mg4j-workbench")
 corpus.set_test_name("TRECquery")
 
-bf = ( BitFunnel( corpus,
-                  r"/bf/cmake/BitFunnel/tools/BitFunnel/src/BitFunnel",
-                  15000000)
-       .build_index()
-)
+bf = BitFunnel( corpus,
+                r"/bf/cmake/BitFunnel/tools/BitFunnel/src/BitFunnel")
 
-mg4j = Mg4j( corpus ).build_index()
+mg4j = Mg4j( corpus )
 
 pef = Pef(corpus, 
-          r"/bf/cmake/pef/bin").build_index()
+          r"/bf/cmake/pef/bin")
+
+corpus.build_indexes()
+corpus.prepare_queries(r"06.efficiency_topics.all")
 
 corpus.run_queries(r"06.efficiency_topics.all", 1)
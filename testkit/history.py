@@ -0,0 +1,289 @@
+# History keeps every benchmark run in a SQLite database, so performance can
+# be followed across engine revisions, and a slowdown caught (and tracked
+# down to its commit) when it appears.
+#
+# Each engine & thread count of a run is recorded with:
+#   revision      the engine's source commit: from a REVISION file (written by
+#                 bfbuild.sh) or git checkout found in a folder above its program
+#   binary        content hash of the program (the jar, for MG4J), which tells
+#                 builds of uncommitted changes apart
+#   corpus        the manifest queried (see ArtifactCache.manifest_hash);
+#                 only runs on the same corpus are compared
+#   index         fingerprint of the engine's index artifacts
+#   params        query log, cache mode, placement, engine settings and any
+#                 parameters given, as JSON
+#   qps, latency percentiles, memory & bytes read, from Results.summary
+#   latencies     the latency of every query (float32), for significance tests
+#
+# compare(engine, baseline, revision) checks each thread count & params run
+# at both revisions for a slowdown, with Welch's t test: of per-query
+# latency (pooled over the runs of each revision) and, given at least two
+# runs of each, of QPS. A slowdown is a regression when it is significant at
+# alpha and larger than min_change (a fraction).
+#
+# bisect(engine, revisions, measure) finds the first of a list of revisions
+# (oldest first: the first good, the last slow) that regresses against the
+# first, testing as few as a binary search needs. measure(revision) must
+# build that revision, run queries and record them; revisions already in the
+# history are not measured again.
+#
+# Usage:
+#   history = History("/bf/data/history.db")
+#   corpus.run_queries(querylog, 1, repetitions=5)
+#   history.record(corpus.analyze(1), querylog)
+#   print(history.compare('bf', baseline, revision))
+#
+#   def measure(revision):
+#       BitFunnel(corpus, build_revision("/bf/bfbuild.sh", revision))
+#       corpus.build_indexes()
+#       corpus.run_queries(querylog, 1, repetitions=5)
+#       history.record(corpus.analyze(1), querylog)
+#   history.bisect('bf', revision_list("/bf/git/BitFunnel", good, bad), measure)
+
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import time
+
+import numpy as np
+
+import signature
+from results import PERCENTILES, Table
+from stats import welch
+
+MEASURES = (["queries", "qps", "mpq", "mean_latency"]
+            + ["p{0}_latency".format(p) for p in PERCENTILES]
+            + ["false_positive_rate", "bits_per_posting", "predicted_memory", "peak_rss", "read_bytes"])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    time REAL,
+    label TEXT,
+    engine TEXT,
+    threads INTEGER,
+    revision TEXT,
+    binary TEXT,
+    corpus TEXT,
+    index_fingerprint TEXT,
+    params TEXT,
+    {0},
+    latencies BLOB);
+CREATE INDEX IF NOT EXISTS runs_engine ON runs (engine, revision);
+""".format(",\n    ".join("{0} REAL".format(name) for name in MEASURES))
+
+# The program each engine runs
+BINARIES = {'bf': lambda engine: engine.bf_executable,
+            'mg4j': lambda engine: engine.corpus.mg4j_jar,
+            'pef': lambda engine: engine.pef_runner,
+            'sig': lambda engine: signature.__file__,
+            'sigexact': lambda engine: signature.__file__}
+
+# Engine settings that change its performance
+SETTINGS = {'bf': ("config_name", "memory"),
+            'mg4j': ("heap",),
+            'pef': ("pef_index_type",),
+            'sig': ("density", "snr"),
+            'sigexact': ()}
+
+class History:
+    def __init__(self, filename):
+        self.filename = filename
+        self.connection = sqlite3.connect(filename)
+        self.connection.executescript(SCHEMA)
+        self.revisions = {}         # program -> source revision
+
+    # Record the runs of Results (or the list of them analyze returns after
+    # repeated runs), labelled (default: the test folder name) and with any
+    # extra parameters (a dict) that distinguish them
+    def record(self, results, querylog=None, label=None, params=None):
+        if isinstance(results, list):
+            for repetition in results:
+                self.record(repetition, querylog, label, params)
+            return self
+
+        corpus = results.corpus
+        label = label or os.path.basename(corpus.test_folder)
+        corpus_fingerprint = corpus.artifacts.manifest_hash(corpus.manifest)
+        rows = []
+        for row in results.summary().rows():
+            engtype, threads = row["engine"], int(row["threads"])
+            engine = corpus.engines[engtype]
+            program = BINARIES[engtype](engine) if engtype in BINARIES else None
+            latencies = results.queries[engtype, threads]["latency"].astype(np.float32)
+            rows.append([time.time(), label, engtype, threads,
+                         self.revision(program),
+                         program_hash(corpus.artifacts, program),
+                         corpus_fingerprint,
+                         index_fingerprint(corpus.artifacts, engine),
+                         json.dumps(run_params(corpus, engtype, engine, querylog, params), sort_keys=True)]
+                        + [number(row.get(name)) for name in MEASURES]
+                        + [latencies.tobytes()])
+        columns = (["time", "label", "engine", "threads", "revision", "binary", "corpus",
+                    "index_fingerprint", "params"] + list(MEASURES) + ["latencies"])
+        with self.connection:
+            self.connection.executemany("INSERT INTO runs ({0}) VALUES ({1})".format(
+                ", ".join(columns), ", ".join("?" * len(columns))), rows)
+        print("Recorded {0} runs in {1}".format(len(rows), self.filename))
+        return self
+
+    # Source revision of a program (None if it can't be found)
+    def revision(self, program):
+        if program is None:
+            return None
+        if program not in self.revisions:
+            self.revisions[program] = source_revision(program)
+        return self.revisions[program]
+
+    # Recorded runs of engine at a revision (or one starting with it, e.g. a
+    # short commit hash) as a list of dicts, oldest first
+    def runs(self, engine, revision=None):
+        query = "SELECT * FROM runs WHERE engine = ?"
+        args = [engine]
+        if revision is not None:
+            query += " AND substr(revision, 1, ?) = ?"
+            args += [len(revision), revision]
+        cursor = self.connection.execute(query + " ORDER BY time", args)
+        names = [column[0] for column in cursor.description]
+        return [dict(zip(names, values)) for values in cursor]
+
+    # Is engine slower at revision than at baseline? One row per thread count,
+    # corpus & params run at both (see above)
+    def compare(self, engine, baseline, revision, alpha=0.01, min_change=0.02):
+        groups = {}
+        for position, wanted in enumerate((baseline, revision)):
+            for run in self.runs(engine, wanted):
+                groups.setdefault((run["threads"], run["corpus"], run["params"]), ([], []))[position].append(run)
+
+        rows = []
+        for (threads, corpus, params), (before, after) in sorted(groups.items()):
+            if not before or not after:
+                continue
+            row = {"engine": engine, "threads": threads, "params": params,
+                   "baseline_runs": len(before), "runs": len(after)}
+            for name, column, slower in (("qps", "qps", -1), ("latency", "latencies", 1)):
+                if column == "latencies":
+                    old = np.concatenate([np.frombuffer(run["latencies"], dtype=np.float32) for run in before])
+                    new = np.concatenate([np.frombuffer(run["latencies"], dtype=np.float32) for run in after])
+                else:
+                    old = np.array([run[column] for run in before if run[column] is not None], dtype=float)
+                    new = np.array([run[column] for run in after if run[column] is not None], dtype=float)
+                old_mean = old.mean() if len(old) else np.nan
+                new_mean = new.mean() if len(new) else np.nan
+                change = new_mean / old_mean - 1 if old_mean else np.nan
+                p = welch(old, new)[2]
+                row["baseline_" + name] = old_mean
+                row[name] = new_mean
+                row[name + "_change"] = change
+                row[name + "_p"] = p
+                row[name + "_regression"] = bool(p < alpha and slower * change > min_change)
+            row["regression"] = row["qps_regression"] or row["latency_regression"]
+            del row["qps_regression"], row["latency_regression"]
+            rows.append(row)
+        return Table.from_rows(rows)
+
+    # The first of revisions (oldest first) where engine regresses against
+    # revisions[0], or None if the last doesn't (see above)
+    def bisect(self, engine, revisions, measure, alpha=0.01, min_change=0.02):
+        baseline = revisions[0]
+        tested = {}
+
+        def regressed(revision):
+            if revision not in tested:
+                if not self.runs(engine, revision):
+                    measure(revision)
+                comparison = self.compare(engine, baseline, revision, alpha, min_change)
+                if len(comparison) == 0:
+                    raise ValueError("No {0} runs of {1} to compare with {2}".format(engine, revision, baseline))
+                print(comparison)
+                tested[revision] = bool(comparison["regression"].any())
+                print("{0} {1}: {2}".format(engine, revision, "regression" if tested[revision] else "good"))
+            return tested[revision]
+
+        if not self.runs(engine, baseline):
+            measure(baseline)
+        good, bad = 0, len(revisions) - 1
+        if bad <= good or not regressed(revisions[bad]):
+            print("No {0} regression from {1} to {2}".format(engine, baseline, revisions[-1]))
+            return None
+        while bad - good > 1:
+            middle = (good + bad) // 2
+            if regressed(revisions[middle]):
+                bad = middle
+            else:
+                good = middle
+        print("First {0} regression: {1}".format(engine, revisions[bad]))
+        return revisions[bad]
+
+    def close(self):
+        self.connection.close()
+
+# Commits from good to bad (oldest first, along first parents) of a git repository
+def revision_list(repository, good, bad):
+    def git(*args):
+        return subprocess.check_output(["git", "-C", repository] + list(args),
+                                       universal_newlines=True).split()
+    return git("rev-parse", good) + git("rev-list", "--reverse", "--first-parent", "{0}..{1}".format(good, bad))
+
+# Build revision with a build script taking it as argument (bfbuild.sh or
+# mg4jbuild.sh, run from its own folder), returning the path it prints last
+def build_revision(script, revision):
+    output = subprocess.check_output(["bash", script, revision], cwd=os.path.dirname(os.path.abspath(script)),
+                                     universal_newlines=True)
+    return output.split()[-1]
+
+# Commit a program was built from: named by a REVISION file, or checked out
+# in a git repository, in its folder or one above (marked "+dirty" when the
+# checkout has changes)
+def source_revision(program):
+    if not os.path.exists(program) and shutil.which(program):
+        program = shutil.which(program)
+    folder = os.path.dirname(os.path.realpath(program))
+    while True:
+        revision_file = os.path.join(folder, "REVISION")
+        if os.path.exists(revision_file):
+            with open(revision_file) as file:
+                return file.read().strip()
+        if os.path.exists(os.path.join(folder, ".git")):
+            try:
+                head = subprocess.check_output(["git", "-C", folder, "rev-parse", "HEAD"],
+                                               universal_newlines=True).strip()
+                changes = subprocess.check_output(["git", "-C", folder, "status", "--porcelain",
+                                                   "--untracked-files=no"], universal_newlines=True)
+            except (OSError, subprocess.CalledProcessError):
+                return None
+            return head + ("+dirty" if changes.strip() else "")
+        parent = os.path.dirname(folder)
+        if parent == folder:
+            return None
+        folder = parent
+
+def program_hash(artifacts, program):
+    try:
+        return artifacts.file_hash(program) if program is not None else None
+    except OSError:
+        return None
+
+# Fingerprint of the index artifacts an engine queries (see artifacts.py)
+def index_fingerprint(artifacts, engine):
+    return artifacts.fingerprint(indexes=[artifacts.fingerprint_of(path)
+                                          for path in engine.index_paths() if os.path.isdir(path)])
+
+# Parameters of a run that change its performance
+def run_params(corpus, engtype, engine, querylog, params):
+    placement = corpus.placement
+    values = {"querylog": querylog,
+              "cache_mode": corpus.cache_mode,
+              "placement": vars(placement) if placement is not None else None,
+              "settings": {name: getattr(engine, name, None) for name in SETTINGS.get(engtype, ())}}
+    values.update(params or {})
+    return values
+
+# A number for SQLite (None for missing values & NaN)
+def number(value):
+    if value is None or isinstance(value, str):
+        return None
+    value = float(value)
+    return None if np.isnan(value) else value
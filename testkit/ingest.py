@@ -0,0 +1,143 @@
+# Ingest turns the raw TREC GOV2 collection into BitFunnel chunk files.
+#
+# GOV2 is a set of folders (GX000 ... GX272) of gzipped bundles (00.gz ...),
+# each holding a few thousand TREC documents:
+#   <DOC> <DOCNO>GX000-00-0000000</DOCNO> <DOCHDR>http headers</DOCHDR> html </DOC>
+#
+# Worker processes each take a bundle from a bounded queue, then decompress,
+# parse and tokenize it as a stream (nothing decompressed is staged on disk),
+# writing one chunk file per bundle (GX000-00.chunk) as they go. Only one
+# document per worker is ever held in memory.
+#
+# Usage (normally via Corpus.ingest_gov2):
+#   ingest_gov2(gov2_folder, chunks_folder, workers)
+
+import gzip
+import multiprocessing
+import os
+import queue
+import re
+
+from chunks import BODY_STREAM, TITLE_STREAM, ChunkWriter
+
+TOKEN = re.compile(rb"[a-z0-9]+")
+TAG = re.compile(rb"<[^>]*>")
+SCRIPT = re.compile(rb"<(script|style)\b.*?</\1\s*>", re.IGNORECASE | re.DOTALL)
+TITLE = re.compile(rb"<title[^>]*>(.*?)</title\s*>", re.IGNORECASE | re.DOTALL)
+ENTITY = re.compile(rb"&#?\w+;")
+DOCNO = re.compile(rb"<DOCNO>\s*GX(\d+)-(\d+)-(\d+)\s*</DOCNO>")
+POLL_INTERVAL = 5           # Seconds between checks that the workers are alive
+
+# Write a chunk file for every GOV2 bundle into chunks_folder, using a pool of
+# workers (default: one per core). Returns (documents, postings) written.
+def ingest_gov2(gov2_folder, chunks_folder, workers=None):
+    workers = workers or os.cpu_count()
+    bundles = gov2_bundles(gov2_folder)
+    context = multiprocessing.get_context("fork")
+    tasks = context.Queue(2 * workers)
+    done = context.Queue(2 * workers)
+    pool = [context.Process(target=ingest_worker, args=(tasks, done, chunks_folder))
+            for i in range(workers)]
+    for process in pool:
+        process.start()
+
+    # Keep the task queue topped up while collecting results
+    documents = postings = finished = 0
+    pending = iter(bundles + [None] * workers)
+    queued = 0
+    while finished < len(bundles):
+        while queued < len(bundles) + workers and not tasks.full():
+            tasks.put(next(pending))
+            queued += 1
+        bundle, count, terms = next_result(done, pool)
+        if count is None:
+            for process in pool:
+                process.terminate()
+            raise RuntimeError("Ingesting {0} failed: {1}".format(bundle, terms))
+        finished += 1
+        documents += count
+        postings += terms
+        print("{0}/{1} {2}: {3} documents".format(finished, len(bundles), bundle, count))
+
+    while queued < len(bundles) + workers:
+        tasks.put(next(pending))
+        queued += 1
+    for process in pool:
+        process.join()
+
+    print("Ingested {0} documents, {1} postings".format(documents, postings))
+    return documents, postings
+
+# The next result posted by a worker, raising if a worker dies (e.g., killed
+# for running out of memory), as its bundle's result would never come
+def next_result(done, pool):
+    while True:
+        try:
+            return done.get(timeout=POLL_INTERVAL)
+        except queue.Empty:
+            dead = [process for process in pool if process.exitcode not in (None, 0)]
+            if dead:
+                for process in pool:
+                    process.terminate()
+                raise RuntimeError("Ingestion worker {0} died (exit code {1})".format(dead[0].pid, dead[0].exitcode))
+
+# All bundles, in collection order
+def gov2_bundles(gov2_folder):
+    return sorted(os.path.join(root, f)
+                  for root, dirs, files in os.walk(gov2_folder)
+                  for f in files if f.endswith(".gz"))
+
+# Convert bundles taken from tasks until a None arrives
+def ingest_worker(tasks, done, chunks_folder):
+    for bundle in iter(tasks.get, None):
+        name = "{0}-{1}.chunk".format(os.path.basename(os.path.dirname(bundle)),
+                                      os.path.basename(bundle)[:-len(".gz")])
+        try:
+            writer = ChunkWriter(os.path.join(chunks_folder, name))
+            for docid, streams in read_bundle(bundle):
+                writer.write_document(docid, streams)
+            writer.close()
+            done.put((bundle, writer.documents, writer.postings))
+        except Exception as error:
+            done.put((bundle, None, str(error)))
+
+# Yield (document id, streams) for each document in a gzipped TREC bundle
+def read_bundle(bundle):
+    with gzip.open(bundle, 'rb') as file:
+        docno = None
+        lines = None
+        for line in file:
+            if line.startswith(b"<DOC>"):
+                docno, lines = None, []
+            elif line.startswith(b"</DOC>"):
+                if docno is not None:
+                    yield docno, tokenize(b"".join(lines))
+                lines = None
+            elif lines is not None:
+                if docno is None:
+                    match = DOCNO.search(line)
+                    if match is not None:
+                        docno = document_id(*match.groups())
+                        continue
+                lines.append(line)
+
+# GX<folder>-<bundle>-<document> as a single number
+def document_id(folder, bundle, document):
+    return (int(folder) * 100 + int(bundle)) * 10000000 + int(document)
+
+# Body & title streams of an html document (after its http header)
+def tokenize(html):
+    header_end = html.find(b"</DOCHDR>")
+    if header_end >= 0:
+        html = html[header_end + len(b"</DOCHDR>"):]
+    html = SCRIPT.sub(b" ", html)
+    title = TITLE.search(html)
+    streams = []
+    if title is not None:
+        streams.append((TITLE_STREAM, terms(title.group(1))))
+    streams.append((BODY_STREAM, terms(ENTITY.sub(b" ", TAG.sub(b" ", html)))))
+    return streams
+
+# Unique lowercase terms of text, in order of first appearance
+def terms(text):
+    return list(dict.fromkeys(TOKEN.findall(text.lower())))
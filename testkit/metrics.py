@@ -0,0 +1,172 @@
+# ResourceMonitor captures the resources used by an engine invocation:
+# wall time and user/sys CPU (from the rusage returned by wait4), plus RSS
+# and read/write bytes sampled over time from /proc for the process and all
+# of its descendants (commands are run through a shell).
+#
+# peak_rss is the largest sum, over the live process tree at one sample, of
+# each process's own high-water mark (VmHWM, which exec resets). rusage's
+# ru_maxrss is kept as rusage_maxrss, but only as an upper bound: it keeps
+# the high-water mark of the forked harness across exec, so even `true`
+# run from a harness holding 800 MB reports 800 MB. Processes that haven't
+# exec'd yet (still the harness) are left out of both, and a process living
+# less than one sample interval may be missed.
+#
+# Usage (by Corpus.run):
+#   monitor = ResourceMonitor(proc.pid).start()
+#   returncode = monitor.wait()        # reaps the process, instead of proc.wait()
+#   monitor.save(metrics_file, extra)  # write the metrics as json
+#
+# A process that keeps running (a repl session) can report each part of its
+# life: mark = monitor.mark(), then monitor.report_since(mark).
+
+import json
+import os
+import threading
+import time
+
+SAMPLE_INTERVAL = 0.5                   # Seconds between /proc samples
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+class ResourceMonitor:
+    def __init__(self, pid, interval=SAMPLE_INTERVAL):
+        self.pid = pid
+        self.interval = interval
+        self.samples = []               # [seconds, rss bytes, read bytes, write bytes]
+        self.io = {}                    # pid -> last (read bytes, write bytes) seen
+        self.peak_rss = 0               # Largest sum of the tree's VmHWM at one sample
+        self.harness = read_cmdline("self")
+        self.rusage = None
+        self.returncode = None
+        self.started = time.time()
+        self.finished = None
+        self.stopping = threading.Event()
+        self.sampling = threading.Lock()
+        self.sampler = threading.Thread(target=self.sample_until_stopped, daemon=True)
+
+    def start(self):
+        self.sample()
+        self.sampler.start()
+        return self
+
+    # Wait for the process to exit, capturing its rusage (which includes the
+    # descendants it waited for), then stop sampling. Returns the exit code.
+    # Descendants still alive once it has exited are sampled before it is reaped.
+    def wait(self):
+        os.waitid(os.P_PID, self.pid, os.WEXITED | os.WNOWAIT)
+        self.sample()
+        pid, status, self.rusage = os.wait4(self.pid, 0)
+        self.finished = time.time()
+        self.returncode = os.waitstatus_to_exitcode(status)
+        self.stopping.set()
+        self.sampler.join()
+        return self.returncode
+
+    def sample_until_stopped(self):
+        while not self.stopping.is_set():
+            self.sample()
+            self.stopping.wait(self.interval)
+
+    # Record RSS & high-water marks of the live process tree and cumulative
+    # I/O of every process seen
+    def sample(self):
+        with self.sampling:
+            self.sample_tree()
+
+    def sample_tree(self):
+        rss = 0
+        hwm = 0
+        for pid in process_tree(self.pid):
+            try:
+                if read_cmdline(pid) == self.harness:
+                    continue    # Forked, not yet exec'd
+                with open("/proc/{0}/statm".format(pid)) as file:
+                    rss += int(file.read().split()[1]) * PAGE_SIZE
+                hwm += read_hwm(pid)
+                self.io[pid] = read_io(pid)
+            except (OSError, ValueError, IndexError):
+                continue        # Process exited while being sampled
+        self.peak_rss = max(self.peak_rss, hwm)
+        read_bytes = sum(io[0] for io in self.io.values())
+        write_bytes = sum(io[1] for io in self.io.values())
+        self.samples.append([round(time.time() - self.started, 3), rss, read_bytes, write_bytes])
+
+    # Metrics as a dictionary
+    def report(self):
+        usage = self.rusage
+        last = self.samples[-1] if self.samples else [0, 0, 0, 0]
+        return {
+            "returncode": self.returncode,
+            "wall_time": (self.finished or time.time()) - self.started,
+            "user_time": usage.ru_utime if usage else None,
+            "sys_time": usage.ru_stime if usage else None,
+            "peak_rss": self.peak_rss,
+            "rusage_maxrss": usage.ru_maxrss * 1024 if usage else None,   # ru_maxrss is in KB
+            "sampled_peak_rss": max((s[1] for s in self.samples), default=0),
+            "read_bytes": last[2],
+            "write_bytes": last[3],
+            "block_reads": usage.ru_inblock if usage else None,
+            "block_writes": usage.ru_oublock if usage else None,
+            "major_faults": usage.ru_majflt if usage else None,
+            "samples": self.samples,
+        }
+
+    # Sample the process now, returning the sample to pass to report_since
+    def mark(self):
+        self.sample()
+        return list(self.samples[-1])
+
+    # Metrics of a still running process since mark: wall time & bytes read and
+    # written since then, with the peak RSS (and other fields) of its life so far
+    def report_since(self, mark):
+        self.sample()
+        last = self.samples[-1]
+        metrics = self.report()
+        metrics.update(wall_time=last[0] - mark[0],
+                       read_bytes=last[2] - mark[2],
+                       write_bytes=last[3] - mark[3],
+                       samples=[sample for sample in self.samples if sample[0] >= mark[0]])
+        return metrics
+
+    # Write metrics (default: report(), plus any extra fields, e.g. the command)
+    # to a json file
+    def save(self, filename, extra=None, report=None):
+        metrics = dict(extra or {})
+        metrics.update(report or self.report())
+        with open(filename, 'w') as file:
+            json.dump(metrics, file, indent=1)
+        return metrics
+
+# All live processes in the tree rooted at pid
+def process_tree(pid):
+    pids = [pid]
+    for parent in pids:
+        try:
+            for task in os.listdir("/proc/{0}/task".format(parent)):
+                with open("/proc/{0}/task/{1}/children".format(parent, task)) as file:
+                    pids.extend(int(child) for child in file.read().split())
+        except OSError:
+            continue
+    return pids
+
+def read_cmdline(pid):
+    with open("/proc/{0}/cmdline".format(pid), 'rb') as file:
+        return file.read()
+
+# Peak resident set of a process since it exec'd (bytes), 0 if it has none (exited)
+def read_hwm(pid):
+    with open("/proc/{0}/status".format(pid)) as file:
+        for line in file:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+# Bytes a process has caused to be read from / written to storage
+def read_io(pid):
+    read_bytes = write_bytes = 0
+    with open("/proc/{0}/io".format(pid)) as file:
+        for line in file:
+            if line.startswith("read_bytes:"):
+                read_bytes = int(line.split()[1])
+            elif line.startswith("write_bytes:"):
+                write_bytes = int(line.split()[1])
+    return read_bytes, write_bytes
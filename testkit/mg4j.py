@@ -1,85 +1,89 @@
 import os
 import platform
 
+import querylogs
+import sizing
+from results import drop_warmup_rows
+
 class Mg4j:
     def __init__(self,
-                 corpus):                          # Corpus object handling docs & queries
+                 corpus,                           # Corpus object handling docs & queries
+                 heap = None):                     # Java heap (bytes) for running queries
+                                                   # (None: predicted from index size, see sizing.py)
 
         self.corpus = corpus                 
         corpus.add_engine('mg4j', self)
+        self.heap = heap
 
         # Establish full path names for files and folders
         self.index_folder = os.path.join(self.corpus.docs_folder, "mg4jindex")
         self.mg4j_basename = os.path.join(self.index_folder, "index")
 
+        # Resources needed by build_index, for Corpus.build_indexes (build_memory: below)
+        self.build_requires = []
+        self.build_cores = 2
+
+        # Queries are given as terms (see querylogs.py, Corpus.prepare_queries)
+        self.query_format = "text"
+
+    # Memory (GB) needed by build_index: the JVM run with Corpus.mg4j_heap
+    @property
+    def build_memory(self):
+        return sizing.jvm_gigabytes(self.corpus.mg4j_heap)
+
+    # An Mg4j with the same settings, for another corpus (e.g., a shard)
+    def for_corpus(self, corpus):
+        return Mg4j(corpus, self.heap)
+
     # Build MG4J index from manifest.txt listed files
-    # This only performs work if index is missing
+    # This only performs work if no index was built from the same manifest & jar
     def build_index(self):
 
-        if os.path.exists(self.index_folder):
-            return self
+        artifacts = self.corpus.artifacts
+        fingerprint = artifacts.fingerprint(manifest=artifacts.manifest_hash(self.corpus.manifest),
+                                            jar=artifacts.file_hash(self.corpus.mg4j_jar))
 
-        # Create index folder
-        os.makedirs(self.index_folder)
+        def index_builder(folder):
+            args = ("it.unimi.di.big.mg4j.tool.IndexBuilder "
+                    "-o \"org.bitfunnel.reproducibility.ChunkManifestDocumentSequence({0})\" "
+                    "{1}").format(self.corpus.manifest, self.mg4j_basename)
+            self.corpus.mg4j_execute(args, "mg4j_build_index.log")
+            self.corpus.check_last_run()
 
-        args = ("it.unimi.di.big.mg4j.tool.IndexBuilder "
-                "-o \"org.bitfunnel.reproducibility.ChunkManifestDocumentSequence({0})\" "
-                "{1}").format(self.corpus.manifest, self.mg4j_basename)
-        self.corpus.mg4j_execute(args, "mg4j_build_index.log")
+        artifacts.build(self.index_folder, "mg4jindex", fingerprint, index_builder,
+                        {"manifest": self.corpus.manifest})
         
         return self
 
+    # Java heap (bytes) for running queries: as set, or else predicted from the index
+    def memory_estimate(self):
+        if self.heap is not None:
+            return self.heap
+        return sizing.mg4j_heap(self.index_folder)
+
+    # Files read by run_queries (for page cache control & index footprint)
+    def index_paths(self):
+        return [self.index_folder]
+
     # Run query log using the specified number/range of threads
-    def run_queries(self, querylog, threads=1):
+    # The log is first run warmup times in the same process (its results dropped)
+    def run_queries(self, querylog, threads=1, warmup=0):
 
         self.mg4j_results_file = os.path.join(self.corpus.test_folder, "mgj4results.csv")
+        querylog = os.path.join(self.corpus.data_folder, querylog)
+        if warmup:
+            warmup_file = os.path.join(self.corpus.test_folder, "mg4j_warmup_queries.txt")
+            warmup_queries = querylogs.warmup_log(querylog, warmup, warmup_file)
+            querylog = warmup_file
         args = ("org.bitfunnel.reproducibility.QueryLogRunner "
                 "mg4j {0} {1} {2} {3}").format(self.mg4j_basename,
-                                               os.path.join(self.corpus.data_folder, querylog),
+                                               querylog,
                                                self.mg4j_results_file,
                                                threads)
-        self.corpus.mg4j_execute(args, "mg4j_run_queries.log")
+        self.corpus.mg4j_execute(args, "mg4j_run_queries.log", self.memory_estimate())
+        if warmup:
+            os.remove(warmup_file)
+            if os.path.exists(self.mg4j_results_file):
+                drop_warmup_rows(self.mg4j_results_file, warmup_queries)
 
         return self
-
-    def analyze_index(self):
-        results = IndexCharacteristics("BitFunnel", self.ingestion_thread_count, self.thread_counts)
-
-        with open(self.bf_run_queries_log, 'r') as myfile:
-            run_queries_log = myfile.read()
-            results.set_float_field("bits_per_posting", "Bits per posting:", run_queries_log)
-            results.set_float_field("total_ingestion_time", "Total ingestion time:", run_queries_log)
-
-        for i, threads in enumerate(self.thread_counts):
-            query_summary_statistics = os.path.join(self.bf_index_path,
-                                                    "results-{0}".format(threads),
-                                                    "QuerySummaryStatistics.txt")
-            with open(query_summary_statistics, 'r') as myfile:
-                data = myfile.read()
-                results.append_float_field("planning_overhead", r"Planning overhead:", data)
-                results.append_float_field("qps", "QPS:", data)
-                results.append_float_field("mps", "MPS:", data)
-                results.append_float_field("mpq", "MPQ:", data)
-                results.append_float_field("mean_query_latency", "Mean query latency:", data)
-
-        self.compute_false_positive_rate(results);
-
-        return results
-
-
-    def analyze_corpus(self, gov2_directories):
-        results = CorpusCharacteristics(gov2_directories, self.min_term_count, self.max_term_count)
-
-        with open(self.bf_build_statistics_log, 'r') as input:
-            build_statistics_log = input.read()
-            results.set_int_field("documents", "Document count:", build_statistics_log)
-            results.set_int_field("terms", "Raw DocumentFrequencyTable count:", build_statistics_log)
-            results.set_int_field("postings", "Posting count:", build_statistics_log)
-            results.set_int_field("bytes", "Total bytes read:", build_statistics_log)
-
-        run_queries_log_file = os.path.join(self.bf_index_path, "results-1", "QuerySummaryStatistics.txt")
-        with open(run_queries_log_file) as input:
-            run_log = input.read()
-            results.set_float_field("matches_per_query", "MPQ:", run_log)
-
-        return results
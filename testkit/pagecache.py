@@ -0,0 +1,67 @@
+# PageCache controls how much of an engine's index is in the OS page cache
+# when its queries start, so cold starts and warm steady state can each be
+# measured on purpose, rather than depending on what ran just before.
+#
+#   cold   index files are dropped from the page cache (posix_fadvise DONTNEED)
+#   warm   index files are read through once, so they are all cached
+#
+# Engines name the files & folders their queries read (index_paths), so the
+# index footprint can be reported beside the bytes actually read during a run
+# (see Corpus.set_cache_mode and the block_reads of metrics.py).
+#
+# Usage (normally via Corpus.set_cache_mode):
+#   files = index_files(engine.index_paths())
+#   evict(files) or warm(files)
+
+import os
+
+CACHE_MODES = (None, "cold", "warm")
+READ_SIZE = 1 << 20
+
+# All files under paths (files or folders, following the symlinks into the
+# artifact cache), without duplicates
+def index_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(root, f)
+                         for root, dirs, names in os.walk(path, followlinks=True)
+                         for f in names)
+        elif os.path.exists(path):
+            files.append(path)
+    return sorted(set(os.path.realpath(f) for f in files))
+
+# Total size of files in bytes
+def footprint(files):
+    return sum(os.path.getsize(f) for f in files)
+
+# Drop files from the page cache. Dirty pages can't be dropped, so they are
+# written first. Returns the bytes covered.
+def evict(files):
+    for filename in files:
+        fd = os.open(filename, os.O_RDONLY)
+        try:
+            os.fdatasync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+    return footprint(files)
+
+# Read files in full, leaving them in the page cache. Returns the bytes read.
+def warm(files):
+    total = 0
+    buffer = bytearray(READ_SIZE)
+    for filename in files:
+        with open(filename, 'rb', buffering=0) as file:
+            for count in iter(lambda: file.readinto(buffer), 0):
+                total += count
+    return total
+
+# Put files in the page cache state of mode (None leaves the cache alone)
+def prepare(files, mode):
+    if mode == "cold":
+        evict(files)
+    elif mode == "warm":
+        warm(files)
+    elif mode is not None:
+        raise ValueError("Unknown cache mode {0} (expected one of {1})".format(mode, CACHE_MODES))
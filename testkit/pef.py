@@ -1,5 +1,9 @@
 import os
 
+import querylogs
+import sizing
+from results import drop_warmup_rows
+
 class Pef:
     def __init__(self,
                  corpus,                          # Corpus object handling docs & queries
@@ -8,6 +12,7 @@ class Pef:
         self.corpus = corpus                 
         corpus.add_engine('pef', self)
 
+        self.pef_path = pef_path
         self.pef_creator = os.path.join(pef_path, "create_freq_index")
         self.pef_runner = os.path.join(pef_path, "Runner")
  
@@ -16,40 +21,89 @@ class Pef:
         self.pefindex_folder = os.path.join(self.corpus.docs_folder, "pefindex")
         self.pef_index_type = "opt"
         self.pef_index_file = os.path.join(self.pefindex_folder, "index." + self.pef_index_type)
+
+        # Resources needed by build_index, for Corpus.build_indexes (build_memory: below)
+        # The PEF index is exported from the MG4J index, so that must be built first
+        self.build_requires = ['mg4j']
+        self.build_cores = 1
+
+        # Queries are given as MG4J term ids (see querylogs.py, Corpus.prepare_queries)
+        self.query_format = "ints"
         
+    # Memory (GB) needed by build_index: the JVM run with Corpus.mg4j_heap (to export the MG4J index)
+    @property
+    def build_memory(self):
+        return sizing.jvm_gigabytes(self.corpus.mg4j_heap)
+
+    # A Pef with the same settings, for another corpus (e.g., a shard)
+    def for_corpus(self, corpus):
+        engine = Pef(corpus, self.pef_path)
+        engine.pef_index_type = self.pef_index_type
+        engine.pef_index_file = os.path.join(engine.pefindex_folder, "index." + engine.pef_index_type)
+        return engine
+
     # Build PEF index from MG4J index
-    # This only performs work if needed data is missing
+    # This only performs work if no index was built from the same MG4J index & binaries
     def build_index(self):
-    
-        if os.path.exists(self.pefindex_folder):
-            return self
-        os.makedirs(self.pefindex_folder)
-
-        # Export info needed to build pef index from mg4j index
-        args = ("org.bitfunnel.reproducibility.IndexExporter "
-                "{0} {1} --index").format(os.path.join(self.mg4jindex_folder, "index"), 
-                                          os.path.join(self.pefindex_folder, "index"))
-        self.corpus.mg4j_execute(args, "pef_build_collection.log")
-
-        # Create PEF index
-        args = ("{0} {1} {2} {3}").format(self.pef_creator,
-                                          self.pef_index_type,
-                                          os.path.join(self.pefindex_folder, "index"),
-                                          self.pef_index_file)
-        self.corpus.execute(args, "pef_build_index.log")
+
+        artifacts = self.corpus.artifacts
+        mg4j_fingerprint = artifacts.fingerprint_of(self.mg4jindex_folder)
+        if mg4j_fingerprint is None:
+            raise RuntimeError("PEF index requires a complete MG4J index in {0}".format(self.mg4jindex_folder))
+        fingerprint = artifacts.fingerprint(mg4jindex=mg4j_fingerprint,
+                                            jar=artifacts.file_hash(self.corpus.mg4j_jar),
+                                            creator=artifacts.file_hash(self.pef_creator),
+                                            index_type=self.pef_index_type)
+
+        def create_index(folder):
+            # Export info needed to build pef index from mg4j index
+            args = ("org.bitfunnel.reproducibility.IndexExporter "
+                    "{0} {1} --index").format(os.path.join(self.mg4jindex_folder, "index"), 
+                                              os.path.join(self.pefindex_folder, "index"))
+            self.corpus.mg4j_execute(args, "pef_build_collection.log")
+            self.corpus.check_last_run()
+
+            # Create PEF index
+            args = ("{0} {1} {2} {3}").format(self.pef_creator,
+                                              self.pef_index_type,
+                                              os.path.join(self.pefindex_folder, "index"),
+                                              self.pef_index_file)
+            self.corpus.execute(args, "pef_build_index.log")
+            self.corpus.check_last_run()
+
+        artifacts.build(self.pefindex_folder, "pefindex", fingerprint, create_index,
+                        {"index_type": self.pef_index_type})
 
         return self
 
+    # Memory (bytes) predicted for running queries (see sizing.py)
+    def memory_estimate(self):
+        return sizing.pef_memory(self.pef_index_file)
+
+    # Files read by run_queries (for page cache control & index footprint)
+    def index_paths(self):
+        return [self.pef_index_file]
+
     # Run query log using the specified number/range of threads
-    def run_queries(self, querylog, threads=1):
+    # The log is first run warmup times in the same process (its results dropped)
+    def run_queries(self, querylog, threads=1, warmup=0):
 
         self.pef_results_file = os.path.join(self.corpus.test_folder, "pefresults.csv")
+        querylog = os.path.join(self.corpus.data_folder, querylog)
+        if warmup:
+            warmup_file = os.path.join(self.corpus.test_folder, "pef_warmup_queries.txt")
+            warmup_queries = querylogs.warmup_log(querylog, warmup, warmup_file)
+            querylog = warmup_file
         args = ("{0} {1} {2} {3} {4} {5}").format(self.pef_runner,
                                                   self.pef_index_type,
                                                   self.pef_index_file,
-                                                  os.path.join(self.corpus.data_folder, querylog),
+                                                  querylog,
                                                   threads,
                                                   self.pef_results_file)
         self.corpus.execute(args, "pef_run_queries.log")
+        if warmup:
+            os.remove(warmup_file)
+            if os.path.exists(self.pef_results_file):
+                drop_warmup_rows(self.pef_results_file, warmup_queries)
 
         return self
\ No newline at end of file
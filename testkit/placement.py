@@ -0,0 +1,159 @@
+# Placement pins each engine run to an explicit set of cores, so thread
+# scaling curves don't depend on where the scheduler happened to put threads
+# or on what else was running:
+#   - one core per query thread, using a single hardware thread of each
+#     physical core before any of their SMT siblings,
+#   - all on one NUMA node when they fit (or on the node asked for), with
+#     memory bound to the same node(s) by numactl --membind, if installed,
+#   - leaving `reserve` cores of the node(s) free for the harness itself
+#     (output pumps and resource sampling) and the OS.
+# Cores are pinned on the command line, by numactl --physcpubind (or taskset
+# without numactl), rather than in a preexec_fn, which can deadlock when
+# commands are started from several threads (as Shards does). Engines inherit
+# the affinity, so do all their threads.
+#
+# Engines run at the same time (e.g., the shards of a Shards cluster) need
+# disjoint cores: split(count) divides a placement's cores between count
+# placements.
+#
+# Usage (normally via Corpus.set_placement):
+#   plan = Placement(node=0).place(threads)
+#   subprocess.Popen(pinned_command(args, plan), shell=True, ...)
+#   plan.describe()     # the placement used, for the run's metrics
+
+import glob
+import os
+import re
+import shutil
+
+NODE_FOLDER = "/sys/devices/system/node"
+CPU_FOLDER = "/sys/devices/system/cpu"
+
+class Placement:
+    def __init__(self,
+                 node=None,         # NUMA node to run on (None: the first where the threads fit)
+                 membind=True,      # Bind memory to the node(s) used, if numactl is installed
+                 reserve=1,         # Cores per node left for the harness & OS
+                 cpus=None):        # Only use these cores (None: any allowed)
+        self.node = node
+        self.membind = membind
+        self.reserve = reserve
+        self.cpus = cpus
+
+    # The cores (and nodes) to use for an engine run with threads query threads
+    def place(self, threads):
+        nodes = topology()
+        allowed = os.sched_getaffinity(0)
+        if self.cpus is not None:
+            allowed = allowed & set(self.cpus)
+        order = sorted(nodes) if self.node is None else [self.node] + sorted(n for n in nodes if n != self.node)
+        if self.node is not None and self.node not in nodes:
+            raise ValueError("No NUMA node {0} (nodes: {1})".format(self.node, sorted(nodes)))
+
+        usable = self.usable(nodes, order, allowed)
+
+        if self.node is None:
+            fits = [node for node in order if len(usable[node]) >= threads]
+            if fits:
+                order = [fits[0]]
+        cpus = []
+        used = []
+        for node in order:
+            if len(cpus) >= threads:
+                break
+            take = usable[node][:threads - len(cpus)]
+            if take:
+                cpus.extend(take)
+                used.append(node)
+        if len(cpus) < threads:
+            print("Placement: only {0} cores available for {1} threads".format(len(cpus), threads))
+        return Plan(sorted(cpus), used, self.membind and shutil.which("numactl") is not None)
+
+    # Usable cores of each node, physical cores first, minus the reserve
+    def usable(self, nodes, order, allowed):
+        usable = {}
+        for node in order:
+            cpus = core_order([cpu for cpu in nodes[node] if cpu in allowed])
+            usable[node] = cpus[:max(len(cpus) - self.reserve, 1)] if cpus else []
+        return usable
+
+    # count placements for engines running at the same time, each given an
+    # equal share of this placement's usable cores (in node order, so a share
+    # spans as few nodes as possible), none shared
+    def split(self, count):
+        nodes = topology()
+        allowed = os.sched_getaffinity(0)
+        if self.cpus is not None:
+            allowed = allowed & set(self.cpus)
+        order = sorted(nodes) if self.node is None else [self.node]
+        cpus = [cpu for cpus in self.usable(nodes, order, allowed).values() for cpu in cpus]
+        share = len(cpus) // count
+        if share == 0:
+            raise ValueError("Only {0} cores to share between {1} placements".format(len(cpus), count))
+        return [Placement(None, self.membind, 0, cpus[index * share:(index + 1) * share])
+                for index in range(count)]
+
+# A placement for one run
+class Plan:
+    def __init__(self, cpus, nodes, membind):
+        self.cpus = cpus
+        self.nodes = nodes
+        self.membind = membind
+
+    def describe(self):
+        return {"cpus": self.cpus,
+                "nodes": self.nodes,
+                "membind": self.membind,
+                "topology": {str(node): cpus for node, cpus in topology().items()},
+                "load_average": os.getloadavg()}
+
+# Command line running args on the plan's cores, with memory bound to its
+# nodes (if it binds)
+def pinned_command(args, plan):
+    if not plan.cpus:
+        return args
+    cpus = ",".join(str(cpu) for cpu in plan.cpus)
+    if shutil.which("numactl") is None:
+        return "taskset -c {0} {1}".format(cpus, args)
+    membind = ""
+    if plan.membind and plan.nodes:
+        membind = " --membind={0}".format(",".join(str(node) for node in plan.nodes))
+    return "numactl --physcpubind={0}{1} {2}".format(cpus, membind, args)
+
+# NUMA node -> its cpus (one node holding every cpu, on a machine without NUMA)
+def topology():
+    nodes = {}
+    for folder in glob.glob(os.path.join(NODE_FOLDER, "node[0-9]*")):
+        cpus = parse_cpu_list(read_file(os.path.join(folder, "cpulist")))
+        if cpus:
+            nodes[int(re.search(r"\d+$", folder).group())] = cpus
+    return nodes or {0: sorted(os.sched_getaffinity(0))}
+
+# cpus ordered so the first hardware thread of each physical core comes before
+# any SMT sibling
+def core_order(cpus):
+    firsts, siblings = [], []
+    seen = set()
+    for cpu in sorted(cpus):
+        core = read_file(os.path.join(CPU_FOLDER, "cpu{0}".format(cpu), "topology", "thread_siblings_list"))
+        (siblings if core and core in seen else firsts).append(cpu)
+        seen.add(core)
+    return firsts + siblings
+
+# "0-3,8,10-11" -> [0, 1, 2, 3, 8, 10, 11]
+def parse_cpu_list(text):
+    cpus = []
+    for part in text.split(","):
+        if "-" in part:
+            first, last = part.split("-")
+            cpus.extend(range(int(first), int(last) + 1))
+        elif part.strip():
+            cpus.append(int(part))
+    return cpus
+
+def read_file(filename):
+    try:
+        with open(filename) as file:
+            return file.read().strip()
+    except OSError:
+        return ""
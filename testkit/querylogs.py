@@ -0,0 +1,121 @@
+# Querylogs prepares a raw query log (e.g., TREC's 06.efficiency_topics.all,
+# with lines like "17:term term") so that every engine runs the same queries:
+# in one pass over the log, each query is normalized with the tokenizer used
+# for the chunks (see ingest.py), repeated terms and (optionally) repeated
+# queries are dropped, as are queries with a term missing from the index,
+# and the result is written in each engine's input format:
+#   text   one query per line, terms separated by spaces (BitFunnel, MG4J)
+#   ints   one query per line, MG4J term ids separated by spaces (PEF)
+#
+# Term ids come from the MG4J term list (<basename>.terms, one term per line,
+# in lexicographic = term id order), which IndexExporter keeps for PEF. It is
+# held as one bytes blob plus an offsets array, searched by bisection.
+#
+# Usage (normally via Corpus.prepare_queries):
+#   prepare_query_log(raw_log, folder, TermDictionary.load(terms_file), dedupe)
+#   warmup_log(log, warmup, filename)   # the log after warmup copies of it (see Corpus.run_queries)
+
+import bisect
+import glob
+import os
+import re
+import shutil
+
+import numpy as np
+
+from ingest import TOKEN
+
+FORMATS = ("text", "ints")
+TOPIC_NUMBER = re.compile(r"^\s*\d+:")
+
+# The term list of the MG4J index in folder (named after the index's field)
+def terms_file(folder):
+    files = sorted(glob.glob(os.path.join(folder, "*.terms")))
+    if not files:
+        raise RuntimeError("No MG4J term list in {0}".format(folder))
+    return files[0]
+
+# Sorted terms, packed for size: term i is blob[offsets[i]:offsets[i+1] - 1]
+class TermDictionary:
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    # Load a term list with one term per line, in sorted order
+    @staticmethod
+    def load(filename):
+        with open(filename, 'rb') as file:
+            blob = file.read()
+        if blob and not blob.endswith(b"\n"):
+            blob += b"\n"
+        newlines = np.flatnonzero(np.frombuffer(blob, dtype=np.uint8) == ord("\n"))
+        offsets = np.concatenate(([0], newlines + 1)).astype(np.int64)
+        return TermDictionary(blob, offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        return self.blob[self.offsets[index]:self.offsets[index + 1] - 1]
+
+    # Term id of term (bytes), or None if it is not in the index
+    def lookup(self, term):
+        index = bisect.bisect_left(self, term)
+        if index < len(self) and self[index] == term:
+            return index
+        return None
+
+# Tokenized terms of a raw query line, without repeats
+def normalize(line):
+    line = TOPIC_NUMBER.sub("", line, count=1)
+    return list(dict.fromkeys(TOKEN.findall(line.lower().encode())))
+
+# Write the queries of raw_log in every format to folder/<name>.text & .ints
+# Without a term dictionary, no queries are dropped for missing terms and no
+# ints file is written. Returns counts of queries read, kept and dropped.
+def prepare_query_log(raw_log, folder, terms=None, dedupe=True):
+    name = os.path.basename(raw_log)
+    counts = {"read": 0, "written": 0, "empty": 0, "duplicate": 0, "missing_terms": 0}
+    seen = set()
+    text = open(os.path.join(folder, name + ".text"), 'wb')
+    ints = open(os.path.join(folder, name + ".ints"), 'w') if terms is not None else None
+
+    with open(raw_log, errors="replace") as file:
+        for line in file:
+            counts["read"] += 1
+            query = normalize(line)
+            if not query:
+                counts["empty"] += 1
+                continue
+            if dedupe:
+                key = b" ".join(sorted(query))
+                if key in seen:
+                    counts["duplicate"] += 1
+                    continue
+                seen.add(key)
+            if terms is not None:
+                ids = [terms.lookup(term) for term in query]
+                if None in ids:
+                    counts["missing_terms"] += 1
+                    continue
+                ints.write(" ".join(str(id) for id in ids) + "\n")
+            text.write(b" ".join(query) + b"\n")
+            counts["written"] += 1
+
+    text.close()
+    if ints is not None:
+        ints.close()
+    print("{0}: {1}".format(name, ", ".join("{0} {1}".format(count, what) for what, count in counts.items())))
+    return counts
+
+# Write warmup copies of the query log at path, then the log itself, to
+# filename, so an engine running it in one process is warm when it reaches
+# the measured copy. Returns the number of warmup queries (results rows to drop).
+def warmup_log(path, warmup, filename):
+    with open(path, 'rb') as file:
+        queries = sum(1 for line in file)
+    with open(filename, 'wb') as out:
+        for copy in range(warmup + 1):
+            with open(path, 'rb') as file:
+                shutil.copyfileobj(file, out)
+    return warmup * queries
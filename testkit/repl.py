@@ -0,0 +1,205 @@
+# ReplSession keeps one BitFunnel repl process running, with the corpus
+# ingested once, and drives it through stdin/stdout. Thread counts, test
+# folders and query logs can then be swept without reloading the index.
+#
+# Things you can do with a session (usually via BitFunnel.start_session):
+# .start(threads, query_threads)               # start repl & ingest the manifest
+# .command(line)                               # run one repl command, returning its output
+# .run_queries(querylog, minthreads, maxthreads, warmup)  # same results as BitFunnel.run_queries
+# .write_matches(querylog, filename)           # documents each query matches, for verify.py
+# .close()                                     # quit repl, saving its resource metrics
+#
+# The repl is started like any engine run (see Corpus.prepare_run): its index
+# files in the page cache state of the corpus cache mode, and pinned to cores
+# by the corpus placement, for its most query threads. Each run_queries leaves
+# bf_run_queries.log (the ingestion statistics & query output) and
+# bf_run_queries.metrics.json (resources used during the run) in the test
+# folder, where Results finds them; the whole session is logged in
+# bf_repl_session.log, in the test folder it was started in.
+
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+from datetime import datetime
+
+from metrics import ResourceMonitor
+
+PROMPT = re.compile(rb"(?:^|\n)\d+: $")     # repl prompt, e.g. "3: "
+SESSION_LOG = "bf_repl_session.log"
+WARMUP_FOLDER = "bf_warmup"                  # Scratch folder (in the test folder) for warmup results
+MATCH = re.compile(r"DocId\((\d+)\)|^\s*(\d+)\s*$", re.M)    # a matched document, in query one output
+RUN_LOG = "bf_run_queries.log"
+
+class ReplSession:
+    def __init__(self, bitfunnel):
+        self.bitfunnel = bitfunnel
+        self.corpus = bitfunnel.corpus
+        self.proc = None
+        self.monitor = None
+        self.config_name = None     # Termtable config loaded
+        self.threads = None         # Ingestion threads
+        self.query_threads = None   # Most query threads, placed for
+        self.args = None            # Command line, with any placement
+        self.context = {}           # Cache mode & placement it was started with
+        self.startup = ""           # Output of loading the manifest (ingestion statistics)
+        self.output = bytearray()
+        self.ready = threading.Event()
+        self.lock = threading.Lock()
+
+    # Start repl, ingest the corpus manifest and wait until it is ready for queries
+    # threads is the number of threads used for ingestion, query_threads the
+    # most that queries will be run with (default: threads)
+    def start(self, threads=1, query_threads=None):
+        self.config_name = self.bitfunnel.config_name
+        self.threads = threads
+        self.query_threads = query_threads
+        self.folder = self.corpus.test_folder
+        config_folder = os.path.join(self.corpus.docs_folder, self.config_name)
+        args = "{0} repl {1} {2}".format(self.bitfunnel.bf_executable, config_folder,
+                                         self.bitfunnel.memory_option())
+        run_context = self.corpus.run_context
+        self.corpus.prepare_run(self.bitfunnel, max(threads, query_threads or threads))
+        self.args, self.context = self.corpus.placed_command(args)
+        self.corpus.run_context = run_context
+        self.log = open(os.path.join(self.folder, SESSION_LOG), 'wb')
+        self.log.write("Running {0} at {1}\n".format(self.args, str(datetime.now())).encode())
+        print(self.args)
+
+        self.proc = subprocess.Popen(self.args, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                     stderr=subprocess.STDOUT, shell=True)
+        self.monitor = ResourceMonitor(self.proc.pid).start()
+        self.reader = threading.Thread(target=self.read_output, daemon=True)
+        self.reader.start()
+        try:
+            self.wait_for_prompt()
+            self.command("threads {0}".format(threads))
+            self.startup = (self.command("load manifest {0}".format(self.corpus.manifest))
+                            + self.command("status"))
+            self.command("compiler")
+        except (RuntimeError, OSError):
+            self.close()
+            raise
+        return self
+
+    # Send one command to repl and return its output once the next prompt appears
+    def command(self, line):
+        with self.lock:
+            self.output.clear()
+            self.ready.clear()
+            self.log.write("\n{0:.3f} in {1}\n".format(time.time() - self.monitor.started, line).encode())
+        self.proc.stdin.write((line + "\n").encode())
+        self.proc.stdin.flush()
+        return self.wait_for_prompt()
+
+    # Run query log using the specified number/range of threads, placing results
+    # in the same test folders as BitFunnel.run_queries
+    # The log is first run warmup times (its output dropped, and not measured)
+    def run_queries(self, querylog, minthreads=1, maxthreads=None, warmup=0):
+        querylog = os.path.join(self.corpus.data_folder, querylog)
+        for line in warmup_commands(self.corpus.test_folder, querylog, maxthreads or minthreads, warmup):
+            self.command(line)
+        remove_warmup(self.corpus.test_folder)
+        mark = self.monitor.mark()
+        output = [self.startup]
+        for threads in range(minthreads, (maxthreads or minthreads) + 1):
+            test_folder = self.corpus.test_folder
+            if maxthreads is not None:
+                test_folder = test_folder + "_" + str(threads)
+                if not os.path.exists(test_folder):
+                    print("mkdir " + test_folder)
+                    os.makedirs(test_folder)
+            output.append(self.command("threads {0}".format(threads)))
+            output.append(self.command("cd {0}".format(test_folder)))
+            output.append(self.command("query log {0}".format(querylog)))
+        self.save_run(mark, output, maxthreads or minthreads)
+        return self
+
+    # Save the log & metrics of one run_queries in the test folder, under the
+    # names BitFunnel.run_queries uses. Bytes read are those since mark (the
+    # repl hasn't exited, so there is no rusage); peak RSS is the session's.
+    def save_run(self, mark, output, threads):
+        with open(os.path.join(self.corpus.test_folder, RUN_LOG), 'w') as file:
+            file.write("Running queries in session {0} at {1}\n".format(self.args, str(datetime.now())))
+            file.write("\n".join(output) + "\n")
+        extra = dict(self.corpus.run_context)
+        extra.update(self.context, threads=threads, command=self.args, logfile=RUN_LOG,
+                     session_log=os.path.join(self.folder, SESSION_LOG))
+        self.monitor.save(os.path.join(self.corpus.test_folder, "bf_run_queries.metrics.json"),
+                          extra, self.monitor.report_since(mark))
+
+    # Write the documents each query of querylog (a file in the data folder)
+    # matches, as "query,document id" rows, running it a query at a time with
+    # "query one", which lists the document ids it matched, one per line
+    def write_matches(self, querylog, filename):
+        with open(os.path.join(self.corpus.data_folder, querylog)) as queries, open(filename, 'w') as file:
+            for query, line in enumerate(queries):
+                output = self.command("query one {0}".format(line.strip()))
+                for docid in sorted(set(query_matches(output))):
+                    file.write("{0},{1}\n".format(query, docid))
+        return filename
+
+    # Quit repl and save its resource usage next to the session log
+    def close(self):
+        if self.proc is None:
+            return self
+        # repl may have exited already (e.g., crashed while loading), but still
+        # has to be reaped, its log closed and its metrics saved
+        try:
+            self.proc.stdin.write(b"quit\n")
+            self.proc.stdin.close()
+        except OSError:
+            pass
+        returncode = self.monitor.wait()
+        self.proc.returncode = returncode
+        self.reader.join()
+        self.log.close()
+        self.monitor.save(os.path.join(self.folder, "bf_repl_session.metrics.json"),
+                          dict(self.context, command=self.args, logfile=SESSION_LOG))
+        print("Finished: {0} return code\n".format(returncode))
+        self.proc = None
+        return self
+
+    # Output up to the next prompt (without it)
+    def wait_for_prompt(self):
+        self.ready.wait()
+        with self.lock:
+            prompt = PROMPT.search(self.output, max(0, len(self.output) - 32))
+            if not prompt:
+                raise RuntimeError("BitFunnel repl exited: see bf_repl_session.log")
+            return self.output[:prompt.start()].decode(errors="replace")
+
+    # Collect repl output as it arrives, flagging when it stops at a prompt
+    def read_output(self):
+        fd = self.proc.stdout.fileno()
+        while True:
+            data = os.read(fd, 65536)
+            if not data:
+                break
+            if not self.corpus.quiet:
+                print(data.decode(errors="replace"), end='', flush=True)
+            with self.lock:
+                self.log.write(data)
+                self.output += data
+                if PROMPT.search(self.output, max(0, len(self.output) - 32)):
+                    self.ready.set()
+        self.ready.set()
+
+# Repl commands that run querylog warmup times with threads, leaving their
+# results in a scratch folder of test_folder (see remove_warmup)
+def warmup_commands(test_folder, querylog, threads, warmup):
+    if not warmup:
+        return []
+    folder = os.path.join(test_folder, WARMUP_FOLDER)
+    os.makedirs(folder, exist_ok=True)
+    return (["threads {0}".format(threads), "cd {0}".format(folder)]
+            + ["query log {0}".format(querylog)] * warmup)
+
+def remove_warmup(test_folder):
+    shutil.rmtree(os.path.join(test_folder, WARMUP_FOLDER), ignore_errors=True)
+
+# Document ids listed in the output of "query one": DocId(n) or a bare number per line
+def query_matches(output):
+    return [int(id or line) for id, line in MATCH.findall(output)]
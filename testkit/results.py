@@ -0,0 +1,357 @@
+# Results loads what the engines leave behind after Corpus.run_queries into
+# columnar tables (a dict of NumPy arrays per table), and summarizes them
+# per engine and thread count.
+#
+# Files read from each test folder (test_folder, or test_folder_<threads>
+# when a range of threads was run):
+#   BitFunnel  QuerySummaryStatistics.txt   "Name: value" lines (QPS, MPQ, ...)
+#              QueryPipelineStatistics.csv  one row per query, with a header
+#              bf_run_queries.log           repl log ("Bits per posting:", ...)
+#   MG4J       mgj4results.csv              one row per query, ending in: matches,time
+#   PEF        pefresults.csv               one row per query, ending in: matches,time
+#   Signature  sigresults.csv               one row per query, ending in: matches,time
+#              SignatureSummary.txt         "Name: value" lines (QPS, MPQ, Bits per posting)
+#              (sigexactresults.csv & SignatureExactSummary.txt for the exact engine)
+#   all        <engine>_run_queries.metrics.json  resources used by the run (see metrics.py)
+# Query times are in seconds. Per-query files are parsed by NumPy's C reader,
+# so a million-query log loads in seconds.
+#
+# Things you can do with results:
+# Results(corpus).load(minthreads, maxthreads)  # parse all engines' results
+# .verify(reference)                           # false positive rate of bf vs. an exact engine
+# .summary()                                   # Table of QPS, MPQ, bits/posting, latency percentiles
+# .queries[engine, threads]                    # per-query Table (matches, latency)
+# repetition_summary(summaries, confidence)    # mean, median & CI over repeated summaries
+# corpus_statistics(corpus)                    # documents, terms, postings from bf statistics
+
+import itertools
+import json
+import os
+import re
+
+import numpy as np
+
+from signature import RESULT_FILES
+from stats import describe
+from verify import POSITIONAL, verify
+
+PERCENTILES = (50, 90, 95, 99)
+MG4J_INDEX_SUFFIXES = (".index", ".counts", ".positions", ".pointers")
+BLOCK_SIZE = 512                # Unit of rusage block_reads
+
+# A columnar table: named NumPy arrays of equal length
+class Table:
+    def __init__(self, columns=None):
+        self.columns = {name: np.asarray(values) for name, values in (columns or {}).items()}
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()))) if self.columns else 0
+
+    # Build a table from a list of rows (dicts with the same keys)
+    @staticmethod
+    def from_rows(rows):
+        if not rows:
+            return Table()
+        return Table({name: [row[name] for row in rows] for name in rows[0]})
+
+    def rows(self):
+        names = list(self.columns)
+        return [dict(zip(names, values)) for values in zip(*self.columns.values())]
+
+    def write_csv(self, filename):
+        with open(filename, 'w') as file:
+            file.write(",".join(self.columns) + "\n")
+            for row in zip(*self.columns.values()):
+                file.write(",".join(str(value) for value in row) + "\n")
+        return self
+
+    def __str__(self):
+        names = list(self.columns)
+        cells = [[format_cell(value) for value in row] for row in zip(*self.columns.values())]
+        widths = [max([len(name)] + [len(row[i]) for row in cells]) for i, name in enumerate(names)]
+        lines = ["  ".join(name.rjust(width) for name, width in zip(names, widths))]
+        lines += ["  ".join(cell.rjust(width) for cell, width in zip(row, widths)) for row in cells]
+        return "\n".join(lines)
+
+class Results:
+    def __init__(self, corpus):
+        self.corpus = corpus
+        self.queries = {}               # (engine, threads) -> per-query Table
+        self.summaries = {}             # (engine, threads) -> dict of summary values
+        self.bits_per_posting = {}      # engine -> bits per posting
+        self.ingestion_time = None      # BitFunnel ingestion time (seconds)
+        self.verified = {}              # (engine, threads) -> verify.verify totals
+        self.metrics = {}               # (engine, threads) -> metrics file of the run
+        self.folders = []
+        self.thread_range = False       # Were a range of thread counts loaded?
+
+    # Parse the results of the registered engines (default: all) for the given
+    # thread counts (the same arguments that were given to Corpus.run_queries)
+    # from the corpus test folder, or test_folder if given (e.g., a repetition's)
+    def load(self, minthreads=1, maxthreads=None, engines=None, test_folder=None):
+        test_folder = test_folder or self.corpus.test_folder
+        self.folders = test_folders(test_folder, minthreads, maxthreads)
+        self.thread_range = maxthreads is not None
+        for threads, folder in self.folders:
+            for engtype in engines or self.corpus.engines:
+                loader = LOADERS.get(engtype)
+                if loader is None:
+                    continue
+                loaded = loader(self, folder)
+                if loaded is None:
+                    print("No {0} results in {1}".format(engtype, folder))
+                    continue
+                queries, summary = loaded
+                self.queries[engtype, threads] = queries
+                self.summaries[engtype, threads] = summary
+                # BitFunnel runs every thread count in one repl, logged in the test folder
+                # (or, by older runs, in the folder of the last thread count)
+                metrics_folders = [folder, test_folder]
+                if engtype == 'bf':
+                    metrics_folders += [other for count, other in reversed(self.folders)]
+                for metrics_folder in metrics_folders:
+                    metrics_file = os.path.join(metrics_folder, "{0}_run_queries.metrics.json".format(engtype))
+                    if os.path.exists(metrics_file):
+                        self.metrics[engtype, threads] = metrics_file
+                        break
+
+        self.bits_per_posting.update(index_bits_per_posting(self.corpus))
+
+        # The repl log is left in whichever test folder was current when it ran
+        for folder in [test_folder] + [folder for threads, folder in self.folders]:
+            log = read_log(os.path.join(folder, "bf_run_queries.log"))
+            if "Bits per posting" in log:
+                self.bits_per_posting['bf'] = log["Bits per posting"]
+                self.ingestion_time = log.get("Total ingestion time")
+        return self
+
+    # Compare BitFunnel's (or another engine's) matches to those of an exact
+    # engine (see verify.py) to find its false positive rate, for each loaded thread count
+    # The reference's matches are in the same test folders, unless reference_folder
+    # is given: a test folder (with _<threads> folders for a range) of the same threads
+    # MG4J & PEF matches are mapped to document ids with Corpus.document_ids
+    def verify(self, reference='mg4j', reference_folder=None, engine='bf'):
+        document_ids = None
+        if reference in POSITIONAL or engine in POSITIONAL:
+            document_ids = self.corpus.document_ids()
+        for threads, folder in self.folders:
+            reference_thread_folder = None
+            if reference_folder is not None:
+                reference_thread_folder = test_folders(reference_folder, threads,
+                                                       threads if self.thread_range else None)[0][1]
+            totals = verify(folder, engine, reference, reference_thread_folder, document_ids)
+            if totals is not None:
+                self.verified[engine, threads] = totals
+        return self
+
+    # One row per engine and thread count
+    # Index footprint, bytes read from storage (see Corpus.set_cache_mode) and
+    # memory predicted (see sizing.py) & used come from the run's metrics.
+    # The bytes read per query are over all the queries of that run (every
+    # thread count, for bf)
+    def summary(self):
+        rows = []
+        runs = {}
+        for key, metrics_file in self.metrics.items():
+            runs[metrics_file] = runs.get(metrics_file, 0) + len(self.queries[key])
+        for (engtype, threads), queries in sorted(self.queries.items()):
+            summary = self.summaries[engtype, threads]
+            latency = queries["latency"]
+            count = len(queries)
+            row = {"engine": engtype,
+                   "threads": threads,
+                   "queries": count,
+                   "qps": summary.get("qps", threads * count / latency.sum() if count else np.nan),
+                   "mpq": summary.get("mpq", queries["matches"].mean() if count else np.nan),
+                   "bits_per_posting": self.bits_per_posting.get(engtype, np.nan),
+                   "false_positive_rate": self.verified.get((engtype, threads), {}).get("false_positive_rate", np.nan),
+                   "mean_latency": latency.mean() if count else np.nan}
+            for p, value in zip(PERCENTILES, latency_percentiles(latency)):
+                row["p{0}_latency".format(p)] = value
+            metrics_file = self.metrics.get((engtype, threads))
+            metrics = read_metrics(metrics_file) if metrics_file else {}
+            if metrics.get("block_reads") is not None:
+                read_bytes = BLOCK_SIZE * metrics["block_reads"]
+            else:
+                read_bytes = metrics.get("read_bytes", np.nan)      # A repl session's run (see repl.py)
+            row["cache_mode"] = metrics.get("cache_mode") or ""
+            row["index_bytes"] = metrics.get("index_bytes", np.nan)
+            row["read_bytes"] = read_bytes
+            row["read_bytes_per_query"] = read_bytes / runs[metrics_file] if metrics_file and runs[metrics_file] else np.nan
+            row["predicted_memory"] = metrics.get("predicted_memory") or np.nan
+            row["peak_rss"] = metrics.get("peak_rss") or np.nan
+            rows.append(row)
+        return Table.from_rows(rows)
+
+    def load_bitfunnel(self, folder):
+        summary_file = os.path.join(folder, "QuerySummaryStatistics.txt")
+        if not os.path.exists(summary_file):
+            return None
+        with open(summary_file) as file:
+            values = read_values(file.read())
+        summary = {"qps": values.get("QPS"), "mpq": values.get("MPQ")}
+        summary = {name: value for name, value in summary.items() if value is not None}
+
+        pipeline_file = os.path.join(folder, "QueryPipelineStatistics.csv")
+        if os.path.exists(pipeline_file):
+            columns = read_csv(pipeline_file, ("matches", "parse", "plan", "match"))
+            latency = sum(columns[name] for name in ("parse", "plan", "match") if name in columns)
+            queries = Table({"matches": columns["matches"], "latency": latency})
+        else:
+            queries = Table({"matches": np.empty(0), "latency": np.empty(0)})
+
+        return queries, summary
+
+    def load_mg4j(self, folder):
+        return load_query_times(os.path.join(folder, "mgj4results.csv"))
+
+    def load_pef(self, folder):
+        return load_query_times(os.path.join(folder, "pefresults.csv"))
+
+    # Query times are shares of batches, so QPS is taken from the whole run
+    def load_signature(self, folder, engtype='sig'):
+        results_file, matches_file, summary_file = RESULT_FILES[engtype]
+        loaded = load_query_times(os.path.join(folder, results_file))
+        if loaded is None:
+            return None
+        queries, summary = loaded
+        values = read_log(os.path.join(folder, summary_file))
+        summary = {name: values[key] for name, key in (("qps", "QPS"), ("mpq", "MPQ")) if key in values}
+        if "Bits per posting" in values:
+            self.bits_per_posting[engtype] = values["Bits per posting"]
+        return queries, summary
+
+LOADERS = {'bf': Results.load_bitfunnel,
+           'mg4j': Results.load_mg4j,
+           'pef': Results.load_pef,
+           'sig': Results.load_signature,
+           'sigexact': lambda results, folder: results.load_signature(folder, 'sigexact')}
+
+# Corpus statistics captured by BitFunnel statistics (bf_run_statistics.log)
+def corpus_statistics(corpus):
+    log = read_log(os.path.join(corpus.test_folder, "bf_run_statistics.log"))
+    return {name: log.get(key) for name, key in (("documents", "Document count"),
+                                                 ("terms", "Raw DocumentFrequencyTable count"),
+                                                 ("postings", "Posting count"),
+                                                 ("bytes", "Total bytes read"))}
+
+# The folder holding results for each thread count, as laid out by Corpus.run_queries
+def test_folders(test_folder, minthreads=1, maxthreads=None):
+    if maxthreads is None:
+        return [(minthreads, test_folder)]
+    return [(threads, test_folder + "_" + str(threads))
+            for threads in range(minthreads, maxthreads + 1)]
+
+# Per-query results whose last two columns are matches and time (seconds)
+def load_query_times(filename):
+    if not os.path.exists(filename):
+        return None
+    skip = 1 if has_header(filename) else 0
+    data = np.loadtxt(filename, delimiter=",", skiprows=skip, usecols=(-2, -1), ndmin=2)
+    return Table({"matches": data[:, 0], "latency": data[:, 1]}), {}
+
+# Named numeric columns of a csv file with a header row
+def read_csv(filename, names):
+    with open(filename) as file:
+        header = [name.strip() for name in file.readline().split(",")]
+    names = [name for name in names if name in header]
+    data = np.loadtxt(filename, delimiter=",", skiprows=1, ndmin=2,
+                      usecols=[header.index(name) for name in names])
+    return {name: data[:, i] for i, name in enumerate(names)}
+
+# Drop the first count rows (after any header) of a per-query results file,
+# those of the warmup queries (see querylogs.warmup_log)
+def drop_warmup_rows(filename, count):
+    skip = 1 if has_header(filename) else 0
+    with open(filename, 'rb') as file, open(filename + ".tmp", 'wb') as out:
+        out.writelines(itertools.islice(file, skip))
+        out.writelines(itertools.islice(file, count, None))
+    os.replace(filename + ".tmp", filename)
+
+def has_header(filename):
+    with open(filename) as file:
+        fields = file.readline().split(",")
+    try:
+        float(fields[-1])
+        return False
+    except ValueError:
+        return True
+
+# "Name: number" values found in text (e.g., a log or summary statistics)
+VALUE_PATTERN = re.compile(r"^(?:[\d.]+ (?:out|err) )?([A-Za-z][^:\n]*):\s*([-+]?[\d.]+(?:[eE][-+]?\d+)?)\s*$",
+                           re.MULTILINE)
+
+def read_values(text):
+    return {name.strip(): float(value) for name, value in VALUE_PATTERN.findall(text)}
+
+def read_log(filename):
+    if not os.path.exists(filename):
+        return {}
+    with open(filename, errors="replace") as file:
+        return read_values(file.read())
+
+def read_metrics(filename):
+    with open(filename) as file:
+        return json.load(file)
+
+# Bits per posting of the MG4J and PEF indexes, from their size on disk and
+# the posting count MG4J records in its .properties file
+def index_bits_per_posting(corpus):
+    mg4j = corpus.engines.get('mg4j')
+    if mg4j is None or not os.path.exists(mg4j.index_folder):
+        return {}
+    files = [os.path.join(mg4j.index_folder, f) for f in os.listdir(mg4j.index_folder)]
+    postings = None
+    for filename in files:
+        if filename.endswith(".properties"):
+            with open(filename) as file:
+                properties = dict(line.strip().split("=", 1) for line in file if "=" in line)
+            if "postings" in properties:
+                postings = float(properties["postings"])
+    if not postings:
+        return {}
+
+    bits = {"mg4j": 8 * sum(os.path.getsize(f) for f in files if f.endswith(MG4J_INDEX_SUFFIXES))}
+    pef = corpus.engines.get('pef')
+    if pef is not None and os.path.exists(pef.pef_index_file):
+        bits["pef"] = 8 * os.path.getsize(pef.pef_index_file)
+    return {engtype: value / postings for engtype, value in bits.items()}
+
+# Combine the summary Tables of repeated runs into one row per engine and
+# thread count, giving the mean, median and confidence interval of QPS and
+# mean latency across repetitions. Rows whose QPS or latency varies by more
+# than max_cv (coefficient of variation) are flagged as high_variance.
+def repetition_summary(summaries, confidence=0.95, max_cv=0.05):
+    measured = {}
+    for summary in summaries:
+        for row in summary.rows():
+            measured.setdefault((row["engine"], row["threads"]), []).append(row)
+
+    rows = []
+    for (engtype, threads), runs in sorted(measured.items()):
+        row = {"engine": engtype, "threads": threads, "repetitions": len(runs)}
+        high_variance = False
+        for name, column in (("qps", "qps"), ("latency", "mean_latency")):
+            stats = describe([run[column] for run in runs], confidence)
+            for statistic in ("mean", "median", "ci_low", "ci_high", "cv"):
+                row["{0}_{1}".format(name, statistic)] = stats[statistic]
+            high_variance = high_variance or stats["cv"] > max_cv
+        row["high_variance"] = high_variance
+        rows.append(row)
+    return Table.from_rows(rows)
+
+def latency_percentiles(latency):
+    if len(latency) == 0:
+        return [np.nan] * len(PERCENTILES)
+    return np.percentile(latency, PERCENTILES)
+
+def format_cell(value):
+    if isinstance(value, (float, np.floating)):
+        return "{0:.6g}".format(value)
+    return str(value)
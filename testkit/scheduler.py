@@ -0,0 +1,105 @@
+# Scheduler runs a set of jobs in parallel worker processes, starting each job
+# once the jobs it depends on have finished and there is room for it within a
+# budget of cores and memory.
+#
+# Things you can do with a scheduler after establishing one:
+# .add_job(name, action, requires, cores, memory)  # register a job (memory in GB)
+# .run()                                           # run all jobs, returns names of failed jobs
+#
+# Jobs run in forked worker processes, so an action may be any callable
+# (e.g., a bound engine method); changes it makes to Python objects are not
+# seen by the parent process, only its results on disk.
+
+import multiprocessing
+import multiprocessing.connection
+import os
+import sys
+import time
+
+class Job:
+    def __init__(self, name, action, requires, cores, memory):
+        self.name = name
+        self.action = action
+        self.requires = list(requires)
+        self.cores = cores
+        self.memory = memory
+        self.process = None
+        self.started = None
+
+class Scheduler:
+    def __init__(self,
+                 cores = None,                    # Cores available to jobs (default: all)
+                 memory = None):                  # Memory (GB) available to jobs (default: all)
+
+        self.cores = cores if cores is not None else os.cpu_count()
+        self.memory = memory if memory is not None else physical_memory()
+        self.jobs = {}
+
+    # Register a job to be run by run()
+    def add_job(self, name, action, requires=(), cores=1, memory=0):
+        self.jobs[name] = Job(name, action, requires, cores, memory)
+        return self
+
+    # Run all jobs, honoring dependencies and the core/memory budget
+    # Jobs whose prerequisites fail (or are unknown) are skipped
+    # Returns the names of jobs that failed or were skipped
+    def run(self):
+        context = multiprocessing.get_context("fork")
+        pending = list(self.jobs.values())
+        running = {}
+        done = set()
+        failed = set()
+
+        while pending or running:
+            # Skip jobs that can never run
+            for job in list(pending):
+                missing = [r for r in job.requires if r in failed or r not in self.jobs]
+                if missing:
+                    print("Skipping {0}: requires {1}".format(job.name, ", ".join(missing)))
+                    pending.remove(job)
+                    failed.add(job.name)
+
+            # Start every ready job that fits in what remains of the budget.
+            # A job bigger than the whole budget is run alone rather than never.
+            cores = self.cores - sum(job.cores for job in running.values())
+            memory = self.memory - sum(job.memory for job in running.values())
+            for job in list(pending):
+                if not all(r in done for r in job.requires):
+                    continue
+                if running and (job.cores > cores or job.memory > memory):
+                    continue
+                print("Starting {0} ({1} cores, {2} GB)".format(job.name, job.cores, job.memory))
+                sys.stdout.flush()      # else the forked worker repeats buffered output
+                job.process = context.Process(target=job.action, name=job.name)
+                job.process.start()
+                job.started = time.time()
+                running[job.process.sentinel] = job
+                pending.remove(job)
+                cores -= job.cores
+                memory -= job.memory
+
+            # Nothing could start, so remaining jobs wait on each other
+            if not running:
+                for job in pending:
+                    print("Skipping {0}: circular requirements".format(job.name))
+                    failed.add(job.name)
+                break
+
+            # Wait for at least one running job to finish
+            for sentinel in multiprocessing.connection.wait(list(running)):
+                job = running.pop(sentinel)
+                job.process.join()
+                elapsed = time.time() - job.started
+                if job.process.exitcode == 0:
+                    done.add(job.name)
+                    print("Finished {0} in {1:.1f}s".format(job.name, elapsed))
+                else:
+                    failed.add(job.name)
+                    print("Failed {0} in {1:.1f}s: exit code {2}".format(job.name, elapsed,
+                                                                          job.process.exitcode))
+
+        return sorted(failed)
+
+# Total physical memory in GB
+def physical_memory():
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / (1024 ** 3)
@@ -0,0 +1,225 @@
+# Shards emulates a cluster on one machine: the corpus manifest is split into
+# shards (balanced by posting count, not by chunk count), every registered
+# engine gets its own index of each shard (built in parallel), and a query
+# log runs against all shards at once, as separate processes. Each shard's
+# per-query results are then merged as a cluster front end would see them:
+#   matches   the union of the shards' matches (shards hold disjoint documents)
+#   latency   the slowest shard's time (max of shards)
+# and written to the corpus test folder in each engine's own result formats,
+# so Corpus.analyze summarizes (and verifies) the emulated cluster as usual.
+#
+# Shard i has its docs in <docs_folder>-shards/shard<i> (its manifest lists
+# the original chunk files) and its results in <test_folder>-shard<i>, for
+# the corpus test folder current when queries are run.
+# With a placement set on the corpus, each shard gets its own share of its
+# cores (see Placement.split).
+# Every shard runs the same text queries (prepare them first with
+# Corpus.prepare_queries). PEF's term ids are per index, so the queries are
+# converted for each shard, leaving out those with a term the shard lacks
+# (they have no matches there); match files are assumed to number queries by
+# line of the log, from 0. MG4J & PEF number documents by position in their
+# shard, so their merged matches are renumbered by position in the corpus.
+#
+# Usage:
+#   shards = Shards(corpus, 4).build(cores, memory)
+#   shards.run_queries(querylog, minthreads, maxthreads).merge(minthreads, maxthreads)
+#   corpus.analyze(minthreads, maxthreads)
+
+import concurrent.futures
+import heapq
+import os
+import threading
+
+import numpy as np
+
+import querylogs
+from chunks import chunk_postings
+from results import LOADERS, Results, test_folders
+from scheduler import Scheduler
+from signature import RESULT_FILES
+from verify import MATCH_FILES, POSITIONAL, read_matches, sort_unique
+
+class Shards:
+    def __init__(self, corpus, count, workers=None):
+        self.corpus = corpus
+        self.shards = [corpus.shard(index, chunks)
+                       for index, chunks in enumerate(split_manifest(corpus.manifest, count, workers))]
+        # Shards run at the same time, so each is pinned to its own cores
+        if corpus.placement is not None:
+            for shard, placement in zip(self.shards, corpus.placement.split(count)):
+                shard.set_placement(placement)
+        self.query_lines = {}       # (shard, query format) -> log line of each query run
+        self.log_lines = 0          # Queries in the log run
+
+    # Build the index of every engine for every shard in parallel worker
+    # processes, within a budget of cores & memory (GB) as Corpus.build_indexes
+    def build(self, cores=None, memory=None):
+        scheduler = Scheduler(cores, memory)
+        for index, shard in enumerate(self.shards):
+            for engtype, engine in shard.engines.items():
+                scheduler.add_job(job_name(engtype, index),
+                                  engine.build_index,
+                                  [job_name(required, index) for required in engine.build_requires],
+                                  engine.build_cores,
+                                  engine.build_memory)
+        failed = scheduler.run()
+        if failed:
+            print("Shard index builds failed: {0}".format(", ".join(failed)))
+        return self
+
+    # Run query log on all shards at once, one engine at a time
+    def run_queries(self, querylog, minthreads=1, maxthreads=None):
+        text_log = self.corpus.query_logs.get(querylog, {}).get("text", querylog)
+        for index, shard in enumerate(self.shards):
+            shard.set_test_folder(shard_test_folder(self.corpus.test_folder, index))
+            shard.query_logs[querylog] = {"text": text_log}
+            self.query_lines[index, "text"] = None
+            if any(engine.query_format == "ints" for engine in shard.engines.values()):
+                shard.query_logs[querylog]["ints"], self.query_lines[index, "ints"] = \
+                    self.convert_ints(shard, os.path.join(self.corpus.data_folder, text_log))
+
+        for engtype in self.corpus.engines:
+            runs = [threading.Thread(target=shard.run_engine_queries,
+                                     args=(engtype, shard.engines[engtype], querylog, minthreads, maxthreads))
+                    for shard in self.shards]
+            for thread in runs:
+                thread.start()
+            for thread in runs:
+                thread.join()
+        return self
+
+    # Write the queries of text_log as term ids of the shard's MG4J index,
+    # returning the ints log and the log line of each query written
+    def convert_ints(self, shard, text_log):
+        terms = querylogs.TermDictionary.load(querylogs.terms_file(os.path.join(shard.docs_folder, "mg4jindex")))
+        folder = os.path.join(shard.docs_folder, "queries")
+        os.makedirs(folder, exist_ok=True)
+        ints_log = os.path.join(folder, os.path.basename(text_log) + ".ints")
+        lines = []
+        line_number = -1
+        with open(text_log, errors="replace") as file, open(ints_log, 'w') as out:
+            for line_number, line in enumerate(file):
+                ids = [terms.lookup(term) for term in querylogs.normalize(line)]
+                if ids and None not in ids:
+                    out.write(" ".join(str(id) for id in ids) + "\n")
+                    lines.append(line_number)
+        self.log_lines = line_number + 1
+        return ints_log, np.array(lines, dtype=np.int64)
+
+    # Merge the shards' results for each engine & thread count into the corpus
+    # test folder(s), as the results of one cluster (after run_queries, since
+    # it knows which queries each shard ran)
+    def merge(self, minthreads=1, maxthreads=None):
+        for position, (threads, folder) in enumerate(test_folders(self.corpus.test_folder, minthreads, maxthreads)):
+            os.makedirs(folder, exist_ok=True)
+            shard_folders = [test_folders(shard_test_folder(self.corpus.test_folder, index),
+                                          minthreads, maxthreads)[position][1]
+                             for index in range(len(self.shards))]
+            for engtype, engine in self.corpus.engines.items():
+                lines = [self.query_lines.get((index, engine.query_format)) for index in range(len(self.shards))]
+                self.merge_queries(engtype, threads, folder, shard_folders, lines)
+                self.merge_matches(engtype, folder, shard_folders, lines)
+        return self
+
+    # Per-query matches (summed) and latency (max) of the shards
+    def merge_queries(self, engtype, threads, folder, shard_folders, lines):
+        loader = LOADERS.get(engtype)
+        loaded = [loader(Results(shard), shard_folder) if loader else None
+                  for shard, shard_folder in zip(self.shards, shard_folders)]
+        if loader is None or any(result is None for result in loaded):
+            print("Missing {0} shard results for {1}".format(engtype, folder))
+            return
+
+        count = max(len(queries) if rows is None else self.log_lines
+                    for (queries, summary), rows in zip(loaded, lines))
+        matches = np.zeros(count)
+        latency = np.zeros(count)
+        for (queries, summary), rows in zip(loaded, lines):
+            rows = np.arange(len(queries)) if rows is None else rows
+            matches[rows] += queries["matches"]
+            latency[rows] = np.maximum(latency[rows], queries["latency"])
+        write_query_results(engtype, folder, matches, latency, threads)
+
+    # The union of the shards' matches, for each query
+    def merge_matches(self, engtype, folder, shard_folders, lines):
+        if engtype not in MATCH_FILES:
+            return
+        files = [os.path.join(shard_folder, MATCH_FILES[engtype]) for shard_folder in shard_folders]
+        if not all(os.path.exists(f) for f in files):
+            return
+        streams = [renumbered(read_matches(f), rows) for f, rows in zip(files, lines)]
+        if engtype in POSITIONAL:
+            streams = [repositioned(stream, corpus_positions(self.corpus.document_ids(), shard.document_ids()))
+                       for stream, shard in zip(streams, self.shards)]
+        with open(os.path.join(folder, MATCH_FILES[engtype]), 'w') as out:
+            query, pieces = None, []
+            for item in heapq.merge(*streams, key=lambda item: item[0]):
+                if item[0] != query and pieces:
+                    write_matches(out, query, pieces)
+                    pieces = []
+                query = item[0]
+                pieces.append(item[1])
+            if pieces:
+                write_matches(out, query, pieces)
+
+# Split the chunks of a manifest into count lists of about equal posting count
+# (largest chunk first, each to the shard with the fewest postings so far)
+def split_manifest(manifest, count, workers=None):
+    with open(manifest) as file:
+        chunks = [line.strip() for line in file if line.strip()]
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        postings = [counts[1] for counts in pool.map(chunk_postings, chunks)]
+
+    shards = [[] for i in range(count)]
+    totals = [0] * count
+    for chunk, chunk_postings_count in sorted(zip(chunks, postings), key=lambda item: -item[1]):
+        smallest = totals.index(min(totals))
+        shards[smallest].append(chunk)
+        totals[smallest] += chunk_postings_count
+    print("Shard postings: {0}".format(", ".join(str(total) for total in totals)))
+    return [sorted(shard) for shard in shards]
+
+# Results of shard index are kept in the test folder of the corpus plus -shard<index>
+def shard_test_folder(test_folder, index):
+    return "{0}-shard{1}".format(test_folder, index)
+
+def job_name(engtype, index):
+    return "{0}-{1}".format(engtype, index)
+
+# Match stream with queries numbered by line of the full log
+def renumbered(stream, rows):
+    for query, ids in stream:
+        yield (query if rows is None else int(rows[query])), ids
+
+# Match stream with documents numbered by position (see corpus_positions)
+def repositioned(stream, positions):
+    for query, ids in stream:
+        yield query, np.sort(positions[ids])
+
+# Position in the corpus of each document of a shard, from their document ids
+def corpus_positions(corpus_ids, shard_ids):
+    order = np.argsort(corpus_ids, kind="stable")
+    return order[np.searchsorted(corpus_ids[order], shard_ids)]
+
+def write_matches(out, query, pieces):
+    for docid in sort_unique(pieces):
+        out.write("{0},{1}\n".format(query, docid))
+
+# Per-query results in the file format of each engine (see results.py),
+# with a QPS for the cluster when every query waits for the slowest shard
+def write_query_results(engtype, folder, matches, latency, threads):
+    if engtype == 'bf':
+        with open(os.path.join(folder, "QueryPipelineStatistics.csv"), 'w') as file:
+            file.write("matches,match\n")
+            for row in zip(matches, latency):
+                file.write("{0:g},{1:.9g}\n".format(*row))
+        with open(os.path.join(folder, "QuerySummaryStatistics.txt"), 'w') as file:
+            file.write("QPS: {0:.9g}\n".format(threads * len(latency) / latency.sum() if latency.sum() else 0))
+            file.write("MPQ: {0:.9g}\n".format(matches.mean() if len(matches) else 0))
+    else:
+        filename = {'mg4j': "mgj4results.csv", 'pef': "pefresults.csv",
+                    'sig': RESULT_FILES['sig'][0], 'sigexact': RESULT_FILES['sigexact'][0]}[engtype]
+        with open(os.path.join(folder, filename), 'w') as file:
+            file.write("query,matches,time\n")
+            for query, row in enumerate(zip(matches, latency)):
+                file.write("{0},{1:g},{2:.9g}\n".format(query, *row))
@@ -0,0 +1,287 @@
+# Signature is an in-process engine: a bit-sliced signature index in NumPy,
+# built the way BitFunnel's termtable lays out rows (all at rank 0), for fast
+# experiments on small corpora and as an exact-vs-signature comparison point.
+#
+# Each term gets rows chosen from its document frequency p and the target bit
+# density d (see sizing.py): a term with p >= d gets a private row; a rarer
+# term sets its bit in k = ceil(log(p / snr) / log(d)) shared rows, picked by
+# hashing the term. Rows are uint64 arrays with one bit per document. A
+# conjunctive query ANDs the rows of all its terms, so it matches every
+# document containing the terms plus some false positives. With exact set,
+# every term gets a private row, so there are none (an exact bitmap index).
+# The exact engine registers as 'sigexact' (the other as 'sig'), with its own
+# index & result files, so it can be the reference that verifies the others.
+#
+# Queries are answered in batches: the rows of a batch of queries are
+# gathered into one array (padded with an all-ones row) and reduced with a
+# vectorized AND, batches being spread over threads. A query's time is its
+# share of its batch's time.
+#
+# Results are written like the other engines' (see results.py & verify.py),
+# with sigexact in place of sig and SignatureExactSummary.txt for the exact engine:
+#   sigresults.csv     query,matches,time
+#   sigmatches.csv     query,document id
+#   SignatureSummary.txt   QPS & MPQ over the whole run, bits per posting
+#   sig_run_queries.metrics.json   (peak RSS is that of the harness process)
+#
+# Things you can do with Signature after establishing it
+# .build_index()                             # Build signature rows, unless already built
+# .run_queries(querylog, threads)            # Run queries and store results
+
+import concurrent.futures
+import hashlib
+import json
+import math
+import os
+import resource
+import time
+
+import numpy as np
+
+import querylogs
+import sizing
+from chunkfilter import mix64
+from chunks import ChunkReader
+
+DEFAULT_DENSITY = 0.15
+BATCH_BYTES = 64 << 20      # Most row data gathered for one batch of queries
+
+# Engine type -> (per-query results, matches, summary) files
+RESULT_FILES = {'sig': ("sigresults.csv", "sigmatches.csv", "SignatureSummary.txt"),
+                'sigexact': ("sigexactresults.csv", "sigexactmatches.csv", "SignatureExactSummary.txt")}
+
+class Signature:
+    def __init__(self,
+                 corpus,                           # Corpus object handling docs & queries
+                 density = DEFAULT_DENSITY,        # Target density of shared rows
+                 snr = sizing.DEFAULT_SNR,         # Signal to noise ratio for rare terms
+                 exact = False):                   # One private row per term (no false positives)
+
+        self.corpus = corpus
+        self.engtype = 'sigexact' if exact else 'sig'
+        corpus.add_engine(self.engtype, self)
+        self.density = density
+        self.snr = snr
+        self.exact = exact
+
+        self.index_folder = os.path.join(self.corpus.docs_folder, self.engtype + "index")
+
+        # Resources needed by build_index, for Corpus.build_indexes
+        self.build_requires = []
+        self.build_cores = 1
+        self.build_memory = 4
+
+        # Queries are given as terms (see querylogs.py, Corpus.prepare_queries)
+        self.query_format = "text"
+
+    # A Signature with the same settings, for another corpus (e.g., a shard)
+    def for_corpus(self, corpus):
+        return Signature(corpus, self.density, self.snr, self.exact)
+
+    # Build signature rows for the documents of the manifest
+    # This only performs work if no index was built from the same manifest & settings
+    def build_index(self):
+        artifacts = self.corpus.artifacts
+        fingerprint = artifacts.fingerprint(manifest=artifacts.manifest_hash(self.corpus.manifest),
+                                            density=self.density,
+                                            snr=self.snr,
+                                            exact=self.exact,
+                                            code=artifacts.file_hash(__file__))
+        artifacts.build(self.index_folder, self.engtype + "index", fingerprint,
+                        lambda folder: build_signatures(self.corpus.manifest, folder,
+                                                        self.density, self.snr, self.exact),
+                        {"manifest": self.corpus.manifest, "density": self.density, "exact": self.exact})
+        return self
+
+    # Run query log using the specified number of threads
+    # The log is first run warmup times (its results dropped)
+    def run_queries(self, querylog, threads=1, warmup=0):
+        index = SignatureIndex(self.index_folder)
+        with open(os.path.join(self.corpus.data_folder, querylog), errors="replace") as file:
+            queries = [index.query_rows(querylogs.normalize(line)) for line in file]
+
+        with concurrent.futures.ThreadPoolExecutor(threads) as pool:
+            for copy in range(warmup):
+                list(pool.map(lambda batch: index.match(queries, batch), query_batches(queries, index.words)))
+            started = time.time()
+            batches = list(query_batches(queries, index.words))
+            answers = list(pool.map(lambda batch: index.match(queries, batch), batches))
+            elapsed = time.time() - started
+
+        folder = self.corpus.test_folder
+        results_file, matches_file, summary_file = RESULT_FILES[self.engtype]
+        total = 0
+        with open(os.path.join(folder, results_file), 'w') as results, \
+             open(os.path.join(folder, matches_file), 'w') as matches:
+            results.write("query,matches,time\n")
+            for batch, (found, seconds) in zip(batches, answers):
+                for query, ids in zip(batch, found):
+                    results.write("{0},{1},{2:.9g}\n".format(query, len(ids), seconds / len(batch)))
+                    for docid in ids:
+                        matches.write("{0},{1}\n".format(query, docid))
+                    total += len(ids)
+        with open(os.path.join(folder, summary_file), 'w') as file:
+            file.write("QPS: {0:.9g}\n".format(len(queries) / elapsed if elapsed else 0))
+            file.write("MPQ: {0:.9g}\n".format(total / len(queries) if queries else 0))
+            with open(os.path.join(self.index_folder, "SignatureIndex.txt")) as index_summary:
+                file.write(index_summary.read())
+
+        # Metrics like those of engines run as commands (see Corpus.run)
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        metrics = dict(self.corpus.run_context, command="signature", wall_time=elapsed,
+                       peak_rss=usage.ru_maxrss * 1024, block_reads=None, returncode=0)
+        with open(os.path.join(folder, "{0}_run_queries.metrics.json".format(self.engtype)), 'w') as file:
+            json.dump(metrics, file, indent=1)
+        self.corpus.last_metrics = metrics
+        print("Signature: {0} queries in {1:.3f}s on {2} threads".format(len(queries), elapsed, threads))
+        return self
+
+    # Files read by run_queries (for page cache control & index footprint)
+    def index_paths(self):
+        return [self.index_folder]
+
+    # Memory (bytes) of the signature rows
+    def memory_estimate(self):
+        rows_file = os.path.join(self.index_folder, "rows.npy")
+        return os.path.getsize(rows_file) if os.path.exists(rows_file) else None
+
+# A built index, its rows memory-mapped
+class SignatureIndex:
+    def __init__(self, folder):
+        self.rows = np.load(os.path.join(folder, "rows.npy"), mmap_mode='r')
+        self.docids = np.load(os.path.join(folder, "docids.npy"))
+        self.row_starts = np.load(os.path.join(folder, "row_starts.npy"))
+        self.term_rows = np.load(os.path.join(folder, "term_rows.npy"))
+        self.terms = querylogs.TermDictionary.load(os.path.join(folder, "terms.txt"))
+        self.words = self.rows.shape[1]
+        self.ones = len(self.rows) - 1        # The last row is all ones (padding)
+
+    # Rows to AND for a query's terms (None if a term is not in any document)
+    def query_rows(self, terms):
+        rows = set()
+        for term in terms:
+            index = self.terms.lookup(term)
+            if index is None:
+                return None
+            rows.update(self.term_rows[self.row_starts[index]:self.row_starts[index + 1]].tolist())
+        return sorted(rows) or None
+
+    # Matching document ids of each query in batch, and the time taken
+    def match(self, queries, batch):
+        started = time.time()
+        width = max(len(queries[query] or ()) for query in batch)
+        found = [np.empty(0, dtype=np.int64)] * len(batch)
+        if width:
+            gather = np.full((len(batch), width), self.ones, dtype=np.int64)
+            for position, query in enumerate(batch):
+                if queries[query]:
+                    gather[position, :len(queries[query])] = queries[query]
+            matched = np.bitwise_and.reduce(self.rows[gather], axis=1)
+            for position, query in enumerate(batch):
+                if queries[query]:
+                    bits = np.unpackbits(matched[position].view(np.uint8), bitorder='little')
+                    found[position] = np.sort(self.docids[np.flatnonzero(bits[:len(self.docids)])])
+        return found, time.time() - started
+
+# Split query numbers into batches whose gathered rows fit in BATCH_BYTES
+def query_batches(queries, words):
+    batch, width = [], 0
+    for query, rows in enumerate(queries):
+        width = max(width, len(rows or ()))
+        if batch and (len(batch) + 1) * width * words * 8 > BATCH_BYTES:
+            yield batch
+            batch, width = [], len(rows or ())
+        batch.append(query)
+    if batch:
+        yield batch
+
+# Build the signature index of the manifest's chunks into folder:
+#   rows.npy        uint64 [rows + 1, words], bit j of a row is document j
+#   docids.npy      document id of each document
+#   terms.txt       terms in sorted order, one per line
+#   row_starts.npy  term i's rows are term_rows[row_starts[i]:row_starts[i + 1]]
+#   term_rows.npy
+def build_signatures(manifest, folder, density, snr, exact):
+    with open(manifest) as file:
+        chunks = [line.strip() for line in file if line.strip()]
+
+    # Pass 1: document frequencies
+    frequency = {}
+    docids = []
+    for chunk in chunks:
+        reader = ChunkReader(chunk)
+        count_terms(reader.documents(), frequency, docids)
+        reader.close()
+    terms = sorted(term for term in frequency if b"\n" not in term)
+    documents = len(docids)
+
+    # Rows of each term
+    p = np.array([frequency[term] for term in terms], dtype=float) / max(documents, 1)
+    if exact:
+        counts = np.ones(len(terms), dtype=np.int64)
+        private = np.ones(len(terms), dtype=bool)
+        shared = 0
+    else:
+        private = p >= density
+        counts = np.where(private, 1, np.maximum(1, np.ceil(np.log(np.maximum(p, 1e-300) / snr)
+                                                                / math.log(density)))).astype(np.int64)
+        shared = int(math.ceil((p[~private] * counts[~private]).sum() / density)) if len(p) else 0
+    private_rows = np.cumsum(private) - 1
+    lookup = {}
+    for index, term in enumerate(terms):
+        if private[index]:
+            lookup[term] = [shared + int(private_rows[index])]
+        else:
+            seed = int.from_bytes(hashlib.blake2b(term, digest_size=8).digest(), "little")
+            lookup[term] = sorted(set(mix64(seed + i) % shared for i in range(counts[index])))
+    row_count = shared + int(private.sum())
+    row_starts = np.concatenate(([0], np.cumsum([len(lookup[term]) for term in terms]))).astype(np.int64)
+    term_rows = np.array([row for term in terms for row in lookup[term]], dtype=np.int64)
+
+    # Pass 2: set each document's bits in its terms' rows
+    words = (documents + 63) // 64
+    signatures = np.zeros((row_count + 1, words), dtype=np.uint64)
+    signatures[row_count] = ~np.uint64(0)
+    position = 0
+    for chunk in chunks:
+        reader = ChunkReader(chunk)
+        position = set_bits(reader.documents(), position, lookup, signatures)
+        reader.close()
+
+    with open(os.path.join(folder, "terms.txt"), 'wb') as file:
+        file.write(b"".join(term + b"\n" for term in terms))
+    np.save(os.path.join(folder, "rows.npy"), signatures)
+    np.save(os.path.join(folder, "docids.npy"), np.array(docids, dtype=np.int64))
+    np.save(os.path.join(folder, "row_starts.npy"), row_starts)
+    np.save(os.path.join(folder, "term_rows.npy"), term_rows)
+    bits_per_posting = 8 * signatures.nbytes / max(sum(frequency.values()), 1)
+    with open(os.path.join(folder, "SignatureIndex.txt"), 'w') as file:
+        file.write("Document count: {0}\nTerm count: {1}\nRow count: {2}\nShared row count: {3}\n"
+                   "Bits per posting: {4:.6g}\n".format(documents, len(terms), row_count, shared, bits_per_posting))
+    print("Signature index: {0} documents, {1} terms, {2} rows ({3} shared), {4:.1f} bits per posting".format(
+        documents, len(terms), row_count, shared, bits_per_posting))
+
+# Add the terms of documents to frequency and their ids to docids
+# (kept apart from build_signatures so no views into the chunk outlive this call)
+def count_terms(documents, frequency, docids):
+    for docid, streams in documents:
+        docids.append(docid)
+        for term in set(term.tobytes() for streamid, terms in streams for term in terms):
+            frequency[term] = frequency.get(term, 0) + 1
+
+# Set the bits of documents (numbered from position) in their terms' rows
+# (lookup maps each term to its rows)
+def set_bits(documents, position, lookup, signatures):
+    rows, columns = [], []
+    for docid, streams in documents:
+        for term in set(term.tobytes() for streamid, terms in streams for term in terms):
+            term_rows = lookup.get(term)
+            if term_rows is not None:
+                rows.extend(term_rows)
+                columns.extend([position] * len(term_rows))
+        position += 1
+    if rows:
+        rows, columns = np.array(rows, dtype=np.int64), np.array(columns, dtype=np.int64)
+        np.bitwise_or.at(signatures, (rows, columns >> 6),
+                         np.left_shift(np.uint64(1), (columns & 63).astype(np.uint64)))
+    return position
@@ -0,0 +1,122 @@
+# Sizing predicts the memory each engine needs to run queries on a corpus,
+# so corpora of very different sizes can be run without hand-tuned settings.
+#
+# BitFunnel (the slice buffer pool given to `repl -memory`) is sized from its
+# statistics: DocFreqTable-<shard>.csv gives the frequency p of each term, and
+# DocumentLengthHistogram.csv the documents and their posting counts. With
+# bit density d and signal to noise ratio snr, a term with p >= d gets a
+# private row, while a rarer term sets bits in k = ceil(log(p / snr) / log(d))
+# shared rows (so its noise, d^k, stays snr times below its signal). Terms
+# too rare to be in the table are counted as having the rarest frequency.
+# Shared rows are filled to density d, so
+#   rows  = private terms + sum(p * k) / d
+#   bytes = rows * documents / 8
+# treating every row as rank 0, so this is an upper bound for treatments
+# using higher ranks. With several shards, the largest row count is used.
+#
+# MG4J's heap is sized from the size of its index on disk, PEF's from its
+# index file (which it loads whole). MG4J builds use the Corpus.mg4j_heap
+# set, and their memory for scheduling is that heap plus the JVM's own.
+#
+# Each estimate has HEADROOM added. Predicted memory is saved in the metrics
+# of each run, beside the peak RSS observed (see Results.summary).
+
+import glob
+import math
+import os
+
+import numpy as np
+
+DEFAULT_SNR = 10
+HEADROOM = 0.25
+JVM_BASE = 1 << 30          # Heap used by MG4J besides the index
+MG4J_INDEX_FACTOR = 1.5     # Heap per byte of index on disk
+JVM_OVERHEAD = 1 << 30      # Memory of a JVM outside its heap
+JAVA_SIZE_UNITS = {"": 1, "k": 1 << 10, "m": 1 << 20, "g": 1 << 30, "t": 1 << 40}
+
+# Predicted BitFunnel slice buffer memory (bytes) for the statistics in
+# folder, with the termtable's density
+def bitfunnel_memory(folder, density, snr=DEFAULT_SNR, headroom=HEADROOM):
+    documents, postings = document_counts(folder)
+    tables = sorted(glob.glob(os.path.join(folder, "DocFreqTable-*.csv")))
+    if documents == 0 or not tables:
+        return None
+    rows = max(term_table_rows(read_frequencies(table), documents, postings, density, snr)
+               for table in tables)
+    return int(math.ceil(rows * documents / 8 * (1 + headroom)))
+
+# Rows needed by terms with these frequencies (see above)
+def term_table_rows(frequencies, documents, postings, density, snr):
+    frequencies = frequencies[frequencies > 0]
+    private = frequencies >= density
+    shared = frequencies[~private]
+    rows_per_term = np.maximum(1, np.ceil(np.log(shared / snr) / math.log(density)))
+    bits = (shared * rows_per_term).sum()
+
+    # Postings of terms missing from the table (adhoc terms)
+    if postings and len(frequencies):
+        missing = postings / documents - frequencies.sum()
+        if missing > 0:
+            rarest = frequencies.min()
+            bits += missing * max(1, math.ceil(math.log(rarest / snr) / math.log(density)))
+    return int(private.sum()) + bits / density
+
+# Term frequencies: the last column of a DocFreqTable
+def read_frequencies(filename):
+    values = []
+    with open(filename) as file:
+        for line in file:
+            try:
+                values.append(float(line.rsplit(",", 1)[-1]))
+            except ValueError:
+                continue            # header
+    return np.array(values)
+
+# (documents, postings) from DocumentLengthHistogram.csv: posting count,documents
+def document_counts(folder):
+    filename = os.path.join(folder, "DocumentLengthHistogram.csv")
+    if not os.path.exists(filename):
+        return 0, 0
+    documents = postings = 0
+    with open(filename) as file:
+        for line in file:
+            fields = line.split(",")
+            try:
+                length, count = int(fields[0]), int(fields[1])
+            except (ValueError, IndexError):
+                continue            # header
+            documents += count
+            postings += length * count
+    return documents, postings
+
+# Predicted MG4J query heap (bytes) for the index in folder
+def mg4j_heap(folder, headroom=HEADROOM):
+    size = folder_size(folder)
+    if size == 0:
+        return None
+    return int(math.ceil((JVM_BASE + MG4J_INDEX_FACTOR * size) * (1 + headroom)))
+
+# Predicted PEF memory (bytes) for an index file
+def pef_memory(index_file, headroom=HEADROOM):
+    if not os.path.exists(index_file):
+        return None
+    return int(math.ceil(os.path.getsize(index_file) * (1 + headroom)))
+
+# Java -Xmx option for a heap of size bytes (in whole MB)
+def java_heap_option(size):
+    return "-Xmx{0}m".format(int(math.ceil(size / (1 << 20))))
+
+# Bytes of a Java size option value, e.g. "16g"
+def java_size(text):
+    text = text.strip().lower()
+    unit = text[-1] if text[-1:] in JAVA_SIZE_UNITS else ""
+    return int(text[:len(text) - len(unit)]) * JAVA_SIZE_UNITS[unit]
+
+# Memory (whole GB, for Scheduler jobs) of a JVM run with a heap of size text
+def jvm_gigabytes(heap):
+    return int(math.ceil((java_size(heap) + JVM_OVERHEAD) / (1 << 30)))
+
+def folder_size(folder):
+    return sum(os.path.getsize(os.path.join(root, f))
+               for root, dirs, files in os.walk(folder, followlinks=True)
+               for f in files)
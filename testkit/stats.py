@@ -0,0 +1,104 @@
+# Stats summarizes repeated measurements (e.g., the QPS of each repetition of
+# a benchmark) with Student's t distribution, which suits the handful of
+# samples a benchmark can afford. Only NumPy and math are needed.
+#
+# describe(values, confidence)   # mean, median, stdev, cv & t confidence interval
+# welch(a, b)                    # Welch's t test: do two samples have different means?
+# t_cdf(t, df)                   # Student's t cumulative distribution
+# t_quantile(p, df)              # its inverse
+
+import math
+
+import numpy as np
+
+# Mean, median, standard deviation, coefficient of variation (stdev / mean)
+# and a confidence interval for the mean of a sample
+def describe(values, confidence=0.95):
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    count = len(values)
+    if count == 0:
+        return {"n": 0, "mean": np.nan, "median": np.nan, "stdev": np.nan, "cv": np.nan,
+                "ci_low": np.nan, "ci_high": np.nan}
+    mean = values.mean()
+    stdev = values.std(ddof=1) if count > 1 else np.nan
+    if count > 1:
+        margin = t_quantile(0.5 + confidence / 2, count - 1) * stdev / math.sqrt(count)
+    else:
+        margin = np.nan
+    return {"n": count,
+            "mean": mean,
+            "median": np.median(values),
+            "stdev": stdev,
+            "cv": stdev / mean if mean else np.nan,
+            "ci_low": mean - margin,
+            "ci_high": mean + margin}
+
+# Welch's t test of samples a and b (variances need not be equal)
+# Returns (t, degrees of freedom, two-sided p value); t > 0 when b's mean is larger
+def welch(a, b):
+    a = np.asarray(a, dtype=float)
+    b = np.asarray(b, dtype=float)
+    if len(a) < 2 or len(b) < 2:
+        return np.nan, np.nan, np.nan
+    va = a.var(ddof=1) / len(a)
+    vb = b.var(ddof=1) / len(b)
+    if va + vb == 0:
+        return 0.0, np.nan, 1.0 if a.mean() == b.mean() else 0.0
+    t = (b.mean() - a.mean()) / math.sqrt(va + vb)
+    df = (va + vb) ** 2 / (va ** 2 / (len(a) - 1) + vb ** 2 / (len(b) - 1))
+    return t, df, 2 * t_cdf(-abs(t), df)
+
+# P(T <= t) for Student's t distribution with df degrees of freedom
+def t_cdf(t, df):
+    tail = 0.5 * incomplete_beta(df / 2, 0.5, df / (df + t * t))
+    return 1 - tail if t > 0 else tail
+
+# t such that P(T <= t) = p, found by bisection
+def t_quantile(p, df):
+    if p == 0.5:
+        return 0.0
+    if p < 0.5:
+        return -t_quantile(1 - p, df)
+    low, high = 0.0, 1.0
+    while t_cdf(high, df) < p:
+        low, high = high, 2 * high
+    for i in range(100):
+        middle = (low + high) / 2
+        if t_cdf(middle, df) < p:
+            low = middle
+        else:
+            high = middle
+    return (low + high) / 2
+
+# Regularized incomplete beta function I_x(a, b), by its continued fraction
+def incomplete_beta(a, b, x):
+    if x <= 0:
+        return 0.0
+    if x >= 1:
+        return 1.0
+    front = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b)
+                     + a * math.log(x) + b * math.log(1 - x))
+    # The continued fraction converges quickly for x below its mean
+    if x > (a + 1) / (a + b + 2):
+        return 1 - incomplete_beta(b, a, 1 - x)
+    return front * beta_fraction(a, b, x) / a
+
+# Lentz's method for the incomplete beta continued fraction
+def beta_fraction(a, b, x, iterations=300, epsilon=1e-15):
+    tiny = 1e-300
+    c = 1.0
+    d = 1 - (a + b) * x / (a + 1)
+    d = 1 / (d if abs(d) > tiny else tiny)
+    result = d
+    for m in range(1, iterations + 1):
+        for numerator in (m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m)),
+                          -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1))):
+            d = 1 + numerator * d
+            d = 1 / (d if abs(d) > tiny else tiny)
+            c = 1 + numerator / c
+            c = c if abs(c) > tiny else tiny
+            result *= d * c
+        if abs(d * c - 1) < epsilon:
+            break
+    return result
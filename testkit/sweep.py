@@ -0,0 +1,119 @@
+# Sweep tunes BitFunnel's termtable over a grid of densities x treatments x
+# thread counts, reporting the frontier of bits per posting vs. QPS and
+# false positive rate.
+#
+# Each variant's termtable is built in its own config folder
+# (config-<density>-<treatment>, see BitFunnel.build_variant), all sharing one
+# statistics run. Termtables are built in parallel within the core/memory
+# budget; queries run one variant at a time so they don't skew each other's QPS.
+# Results for a variant go to <test_folder>-<density>-<treatment>[_<threads>].
+#
+# Usage:
+#   sweep = Sweep(bf, [0.1, 0.15, 0.2], ["Optimal", "PrivateSharedRank0"])
+#   sweep.build(cores, memory).run(querylog, minthreads, maxthreads)
+#   print(sweep.report(reference='sigexact'))  # also saved as sweep.csv
+#
+# Variants are run like any engine run (Corpus.run_engine_queries), so the
+# corpus cache mode and placement apply to them. False positive rates need
+# BitFunnel's matches (BitFunnel(..., matches=True)) and the reference
+# engine's, for the same query log, in the current test folder (e.g., from
+# Corpus.run_queries); report raises if either is missing. Without a
+# reference, the frontier is of bits per posting vs. QPS only.
+
+import itertools
+import os
+
+import numpy as np
+
+from results import Results, Table
+from scheduler import Scheduler
+from verify import MATCH_FILES
+
+class Sweep:
+    def __init__(self,
+                 bitfunnel,                       # BitFunnel engine to tune
+                 densities,                       # Termtable densities to try
+                 treatments):                     # Termtable treatments to try
+
+        self.bitfunnel = bitfunnel
+        self.corpus = bitfunnel.corpus
+        self.variants = list(itertools.product(densities, treatments))
+        self.test_folder = self.corpus.test_folder
+        self.threads = (1, None)
+
+    # Build the termtable of every variant, in parallel worker processes
+    def build(self, cores=None, memory=None):
+        # Statistics are shared, so gather them (if missing) before building variants
+        self.bitfunnel.build_statistics()
+
+        scheduler = Scheduler(cores, memory)
+        for density, treatment in self.variants:
+            scheduler.add_job("termtable-{0}-{1}".format(density, treatment),
+                              lambda d=density, t=treatment: self.bitfunnel.build_variant(d, t),
+                              (),
+                              self.bitfunnel.build_cores,
+                              self.bitfunnel.build_memory)
+        failed = scheduler.run()
+        if failed:
+            print("Termtable builds failed: {0}".format(", ".join(failed)))
+        return self
+
+    # Run query log against every variant, for the specified number/range of threads
+    def run(self, querylog, minthreads=1, maxthreads=None):
+        self.threads = (minthreads, maxthreads)
+        for density, treatment in self.variants:
+            self.corpus.set_test_name(self.variant_test_name(density, treatment))
+            self.bitfunnel.use_variant(density, treatment)
+            self.corpus.run_engine_queries('bf', self.bitfunnel, querylog, minthreads, maxthreads)
+
+        self.bitfunnel.use_variant()
+        self.corpus.test_folder = self.test_folder
+        return self
+
+    # One row per variant & thread count, marking the rows on the frontier:
+    # those no other variant beats in bits per posting, QPS and false positive rate
+    # (verified against reference, if given)
+    def report(self, reference=None):
+        minthreads, maxthreads = self.threads
+        rows = []
+        for density, treatment in self.variants:
+            self.corpus.test_folder = os.path.join(self.corpus.data_folder,
+                                                   self.variant_test_name(density, treatment))
+            results = Results(self.corpus).load(minthreads, maxthreads, ['bf'])
+            if reference is not None:
+                results.verify(reference, self.test_folder)
+                unverified = [folder for threads, folder in results.folders
+                              if ('bf', threads) in results.queries and ('bf', threads) not in results.verified]
+                if unverified:
+                    self.corpus.test_folder = self.test_folder
+                    raise ValueError("No false positive rate for {0}: it needs {1} there (BitFunnel created with "
+                                     "matches=True) and {2} in {3} (see verify.py)".format(
+                                         ", ".join(unverified), MATCH_FILES['bf'], MATCH_FILES[reference],
+                                         self.test_folder))
+            for row in results.summary().rows():
+                rows.append(dict({"density": density, "treatment": treatment}, **row))
+        self.corpus.test_folder = self.test_folder
+
+        for row in rows:
+            row["frontier"] = not any(dominates(other, row) for other in rows
+                                      if other["threads"] == row["threads"])
+        table = Table.from_rows(rows)
+        table.write_csv(os.path.join(self.test_folder, "sweep.csv"))
+        return table
+
+    def variant_test_name(self, density, treatment):
+        return "{0}-{1}-{2}".format(os.path.basename(self.test_folder), density, treatment)
+
+# True if row a is at least as good as row b in every respect, and better in one
+# (a false positive rate that was not measured is ignored)
+def dominates(a, b):
+    costs = [("bits_per_posting", 1), ("qps", -1), ("false_positive_rate", 1)]
+    better = False
+    for name, sign in costs:
+        x, y = sign * a[name], sign * b[name]
+        if np.isnan(x) or np.isnan(y):
+            continue
+        if x > y:
+            return False
+        better = better or x < y
+    return better
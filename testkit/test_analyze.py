@@ -0,0 +1,55 @@
+# End-to-end check of Corpus.analyze on a small generated corpus: the
+# signature engine's matches are verified against the exact signature engine,
+# so its summary has a false positive rate (and nothing is missed).
+#
+# Run from testkit: python -m pytest -q
+
+import random
+
+import numpy as np
+
+from chunks import ChunkWriter
+from corpus import Corpus
+from signature import Signature
+
+CHUNKS = 3
+DOCUMENTS = 400         # Per chunk
+VOCABULARY = 300
+QUERIES = 50
+
+def make_corpus(data_folder):
+    rnd = random.Random(1)
+    vocabulary = ["t{0}".format(i) for i in range(VOCABULARY)]
+    weights = [1 / (i + 1) for i in range(VOCABULARY)]
+    chunks_folder = data_folder / "docs" / "chunks"
+    chunks_folder.mkdir(parents=True)
+    docid = 0
+    for chunk in range(CHUNKS):
+        writer = ChunkWriter(str(chunks_folder / "chunk{0}".format(chunk)))
+        for document in range(DOCUMENTS):
+            terms = dict.fromkeys(rnd.choices(vocabulary, weights, k=rnd.randint(5, 60)))
+            writer.write_document(docid * 7 + 3, [(0, [term.encode() for term in terms])])
+            docid += 1
+        writer.close()
+    # A common term with a rare one (rare terms share rows, which adds false positives)
+    queries = set()
+    while len(queries) < QUERIES:
+        queries.add(rnd.choice(vocabulary[:10]) + " " + rnd.choice(vocabulary[50:]))
+    with open(data_folder / "queries.txt", 'w') as file:
+        file.write("".join(query + "\n" for query in sorted(queries)))
+
+def test_analyze_verifies_signatures(tmp_path):
+    make_corpus(tmp_path)
+    corpus = Corpus(str(tmp_path), str(tmp_path / "mg4j")).set_quiet(True)
+    Signature(corpus)
+    Signature(corpus, exact=True)
+    corpus.build_indexes()
+    corpus.prepare_queries("queries.txt")
+    corpus.run_queries("queries.txt", 1)
+
+    results = corpus.analyze(1)
+    rows = {row["engine"]: row for row in results.summary().rows()}
+    assert rows["sig"]["queries"] == QUERIES
+    assert not np.isnan(rows["sig"]["false_positive_rate"])
+    assert rows["sig"]["false_positive_rate"] > 0
+    assert results.verified['sig', 1]["missed"] == 0
@@ -0,0 +1,157 @@
+# Verify compares the documents BitFunnel matched for each query against an
+# exact engine (MG4J or PEF), counting the false positives that signatures
+# add and any matches BitFunnel missed (which should never happen).
+#
+# Match files hold one "query,document id" row per match, grouped by query
+# (in query order) and sorted by document id within each query.
+#   BitFunnel  QueryMatches.csv
+#   MG4J       mg4jmatches.csv
+#   PEF        pefmatches.csv
+#   Signature  sigmatches.csv
+#   Exact signature  sigexactmatches.csv
+# The signature engines write theirs on every run, BitFunnel when created
+# with matches=True (from the repl's "query one" output, see repl.py), and
+# Shards.merge merges those of shards. MG4J QueryLogRunner and PEF Runner
+# report per-query match counts but not the documents matched, so their
+# match files can only be compared if put in the test folder by other means
+# (e.g., builds of those tools that write them); otherwise use an exact
+# signature engine (Signature(corpus, exact=True), 'sigexact') as the reference.
+#
+# BitFunnel and the signature engine report the document ids of the chunk
+# files. MG4J numbers documents by their position in manifest order, and the
+# PEF index is exported from MG4J's, so their matches are positions, mapped
+# to document ids with document_ids(manifest) (see Corpus.document_ids).
+#
+# Match files are streamed a block of rows at a time, so memory is bounded by
+# the block size plus the matches of the largest single query.
+#
+# Usage:
+#   summary = verify(test_folder, 'bf', 'sigexact')   # also writes bf_vs_sigexact.csv there
+#   summary = verify(test_folder, 'bf', 'mg4j', document_ids=corpus.document_ids())
+
+import itertools
+import os
+
+import numpy as np
+
+from chunks import ChunkReader
+
+MATCH_FILES = {'bf': "QueryMatches.csv",
+               'mg4j': "mg4jmatches.csv",
+               'pef': "pefmatches.csv",
+               'sig': "sigmatches.csv",
+               'sigexact': "sigexactmatches.csv"}
+POSITIONAL = ('mg4j', 'pef')        # Engines numbering documents by position in manifest order
+BLOCK_ROWS = 1 << 20
+
+# Compare the matches of engine against the exact reference engine for every query
+# The reference's matches are read from reference_folder (default: the test folder)
+# Per-query counts are written to <engine>_vs_<reference>.csv in the test folder
+# document_ids (position -> document id) is needed if either engine is POSITIONAL
+# Returns the totals, or None if either match file is missing
+def verify(test_folder, engine='bf', reference='mg4j', reference_folder=None, document_ids=None):
+    engine_file = os.path.join(test_folder, MATCH_FILES[engine])
+    reference_file = os.path.join(reference_folder or test_folder, MATCH_FILES[reference])
+    if not os.path.exists(engine_file) or not os.path.exists(reference_file):
+        return None
+    if document_ids is None and (engine in POSITIONAL or reference in POSITIONAL):
+        raise ValueError("Verifying {0} against {1} needs the document ids of the manifest".format(engine, reference))
+
+    totals = {"queries": 0, "matches": 0, "true_matches": 0, "false_positives": 0, "missed": 0}
+    output = os.path.join(test_folder, "{0}_vs_{1}.csv".format(engine, reference))
+    with open(output, 'w') as out:
+        out.write("query,matches,true_matches,false_positives,missed,false_positive_rate\n")
+        for query, found, expected in merge_queries(engine_matches(engine_file, engine, document_ids),
+                                                    engine_matches(reference_file, reference, document_ids)):
+            false_positives = difference_count(found, expected)
+            missed = difference_count(expected, found)
+            rate = false_positives / len(found) if len(found) else 0.0
+            out.write("{0},{1},{2},{3},{4},{5:.6g}\n".format(query, len(found), len(expected),
+                                                              false_positives, missed, rate))
+            totals["queries"] += 1
+            totals["matches"] += len(found)
+            totals["true_matches"] += len(expected)
+            totals["false_positives"] += false_positives
+            totals["missed"] += missed
+
+    matches = totals["matches"]
+    totals["false_positive_rate"] = totals["false_positives"] / matches if matches else 0.0
+    return totals
+
+# Is there a match file of engine in folder?
+def has_matches(folder, engine):
+    return engine in MATCH_FILES and os.path.exists(os.path.join(folder, MATCH_FILES[engine]))
+
+# Matches of an engine, as document ids
+def engine_matches(filename, engine, document_ids):
+    stream = read_matches(filename)
+    if engine not in POSITIONAL:
+        return stream
+    return ((query, np.sort(document_ids[positions])) for query, positions in stream)
+
+# Document id of each document of a manifest, in order (MG4J's numbering)
+def document_ids(manifest):
+    with open(manifest) as file:
+        chunks = [line.strip() for line in file if line.strip()]
+    ids = []
+    for chunk in chunks:
+        reader = ChunkReader(chunk)
+        ids.extend(docid for docid, streams in reader.documents())
+        reader.close()
+    return np.array(ids, dtype=np.int64)
+
+# Yield (query, sorted document ids) for each query in a match file
+def read_matches(filename):
+    with open(filename) as file:
+        carry_query, carry_ids = None, []
+        while True:
+            lines = list(itertools.islice(file, BLOCK_ROWS))
+            if not lines:
+                break
+            block = np.loadtxt(lines, delimiter=",", dtype=np.int64, ndmin=2)
+            queries, ids = block[:, 0], block[:, 1]
+
+            # Split the block where the query changes; the last group may continue
+            # into the next block, so it is carried over
+            starts = np.concatenate(([0], np.flatnonzero(np.diff(queries)) + 1))
+            ends = np.concatenate((starts[1:], [len(queries)]))
+            for start, end in zip(starts, ends):
+                query = int(queries[start])
+                if query != carry_query:
+                    if carry_query is not None:
+                        yield carry_query, sort_unique(carry_ids)
+                    carry_query, carry_ids = query, []
+                carry_ids.append(ids[start:end])
+        if carry_query is not None:
+            yield carry_query, sort_unique(carry_ids)
+
+# Walk two match streams in query order, yielding (query, ids1, ids2)
+# A query missing from one stream had no matches there
+def merge_queries(stream1, stream2):
+    empty = np.empty(0, dtype=np.int64)
+    item1, item2 = next(stream1, None), next(stream2, None)
+    while item1 is not None or item2 is not None:
+        if item2 is None or (item1 is not None and item1[0] < item2[0]):
+            yield item1[0], item1[1], empty
+            item1 = next(stream1, None)
+        elif item1 is None or item2[0] < item1[0]:
+            yield item2[0], empty, item2[1]
+            item2 = next(stream2, None)
+        else:
+            yield item1[0], item1[1], item2[1]
+            item1, item2 = next(stream1, None), next(stream2, None)
+
+# Number of ids in sorted array a that are not in sorted array b
+# (a merge of the two, done as a vectorized binary search of a's ids in b)
+def difference_count(a, b):
+    if len(b) == 0:
+        return len(a)
+    positions = np.searchsorted(b, a)
+    found = b[np.minimum(positions, len(b) - 1)] == a
+    return int(len(a) - np.count_nonzero(found))
+
+def sort_unique(pieces):
+    ids = np.concatenate(pieces) if len(pieces) > 1 else pieces[0]
+    if len(ids) > 1 and not np.all(ids[1:] > ids[:-1]):
+        ids = np.unique(ids)
+    return ids